@@ -0,0 +1,563 @@
+# Agendador.py
+"""
+Modo serviço: processo que fica no ar no lugar do cron + Diario.py.
+
+- Mantém a sessão HTTP (pool de conexões) e o token de login aquecidos,
+  renovando o login antes de expirar.
+- Dispara o backup diário no horário configurado (HORA_DIARIO).
+- Roda a compactação em segundo plano, fora do caminho do backup.
+- Aceita backups sob demanda por HTTP local:
+
+    POST /backfill  {"data": "20251123"}                      (todas as empresas)
+    POST /backfill  {"inicio": "20251120", "fim": "20251123",
+                     "empresa": "x@y.com.br", "linha": "301C"}
+    POST /diario    {"data": "20251123"}   (refaz o backup diário de uma data)
+    GET  /jobs/<id>                        (andamento de um job)
+    GET  /status
+
+  Ex: curl -X POST localhost:8765/backfill -d '{"data": "20251123"}'
+
+Os jobs rodam um por vez, na ordem em que chegaram. Com CITTATI_CONTAS
+definido, usa as várias contas (ver Diario.py).
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import itertools
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+import Diario
+import Requisicoes
+import Backup_Cittati
+
+
+# ================== CONFIGURAÇÕES ==================
+
+# Horário do backup diário (HH:MM, horário local)
+HORA_DIARIO = os.getenv("CITTATI_HORA_DIARIO", "02:00")
+
+# Endpoint local para jobs sob demanda (só localhost por padrão)
+HOST = os.getenv("CITTATI_AGENDADOR_HOST", "127.0.0.1")
+PORTA = int(os.getenv("CITTATI_AGENDADOR_PORTA", "8765"))
+
+# Refaz o login depois desse tempo, antes do token expirar no servidor
+RENOVAR_LOGIN_A_CADA = Requisicoes.RENOVAR_LOGIN_A_CADA
+
+# De quanto em quanto tempo conferir se o login precisa ser renovado
+INTERVALO_MANTER_QUENTE = 60
+
+# Quantos jobs finalizados ficam guardados para consulta em /jobs
+MAX_JOBS_GUARDADOS = 100
+
+# Quantas vezes, por data, refazer o login e rebuscar as empresas que
+# voltaram com "Token inválido"
+MAX_RELOGINS_POR_DATA = 3
+
+
+# ================== SESSÃO AQUECIDA ==================
+
+
+class SessoesQuentes:
+    """
+    Guarda as contas logadas no mesmo formato do Diario.login_contas:
+    [(conta, session, token, empresas), ...]. Cada conta tem uma sessão
+    fixa, reaproveitada entre jobs; só o token é renovado.
+
+    Uma conta que falha no login fica de fora até conseguir logar de novo
+    (nova tentativa a cada obter()); as outras seguem normalmente.
+    """
+
+    def __init__(self, contas=None):
+        # {} = conta padrão do Diario (CITTATI_USUARIO / CITTATI_SENHA)
+        self.contas = contas or [{}]
+        self._sessoes = [Requisicoes.criar_sessao_com_retry() for _ in self.contas]
+        self._lock = threading.Lock()
+        self._logadas = None  # {indice da conta: (conta, session, token, empresas)}
+        self.sem_login = []   # usuários das contas que falharam no último login
+        self.logado_em = None  # time.monotonic() do último login
+
+    def _login_conta(self, i):
+        conta = self.contas[i]
+        token, empresas = Diario.obter_identificacao_login(
+            self._sessoes[i], conta.get("usuario"), conta.get("senha")
+        )
+        return conta, self._sessoes[i], token, empresas
+
+    def _login(self, indices):
+        """Login das contas em paralelo; retorna {indice: logada} das que deram certo."""
+        logadas = {}
+        with ThreadPoolExecutor(max_workers=len(indices)) as pool:
+            futuros = {pool.submit(self._login_conta, i): i for i in indices}
+            for fut in as_completed(futuros):
+                i = futuros[fut]
+                try:
+                    logadas[i] = fut.result()
+                except (requests.RequestException, KeyError, ValueError) as e:
+                    usuario = self.contas[i].get("usuario", "padrão")
+                    print(f"[agendador] falha no login da conta {usuario}: {e}")
+        return logadas
+
+    def obter(self):
+        """
+        Contas logadas; refaz o login se o token estiver velho e tenta de
+        novo as contas que tinham falhado.
+        """
+        with self._lock:
+            if (
+                self._logadas is None
+                or self.logado_em is None
+                or time.monotonic() - self.logado_em > RENOVAR_LOGIN_A_CADA
+            ):
+                logadas = self._login(list(range(len(self.contas))))
+                if not logadas:
+                    raise RuntimeError("Nenhuma conta conseguiu fazer login.")
+                self._logadas = logadas
+                self.logado_em = time.monotonic()
+            else:
+                faltando = [i for i in range(len(self.contas)) if i not in self._logadas]
+                if faltando:
+                    self._logadas = {**self._logadas, **self._login(faltando)}
+
+            self.sem_login = [
+                self.contas[i].get("usuario", "padrão")
+                for i in range(len(self.contas))
+                if i not in self._logadas
+            ]
+            return [self._logadas[i] for i in sorted(self._logadas)]
+
+    def invalidar(self):
+        """Força novo login no próximo obter()."""
+        with self._lock:
+            self.logado_em = None
+
+
+def empresas_com_token_invalido(resultado):
+    """Empresas que voltaram com 'Token inválido' (codigoErro 02)."""
+    return {
+        empresa
+        for empresa, dados in resultado["empresas"].items()
+        if Requisicoes.resposta_token_invalido(dados)
+    }
+
+
+def proximo_horario(hora_minuto, agora):
+    """Próxima ocorrência de HH:MM a partir de 'agora'."""
+    hora, minuto = (int(p) for p in hora_minuto.split(":"))
+    alvo = agora.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+    if alvo <= agora:
+        alvo += timedelta(days=1)
+    return alvo
+
+
+# ================== AGENDADOR ==================
+
+
+class Agendador:
+    """Fila de jobs (diário/backfill) executados um por vez."""
+
+    def __init__(self, hora_diario, contas=None):
+        self.hora_diario = hora_diario
+        self.proximo_diario = None
+        self.sessoes = SessoesQuentes(contas)
+        self.historico = Requisicoes.carregar_historico_latencias()
+        self.fila = queue.Queue()
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # setado enquanto um job roda: o login não é renovado em segundo
+        # plano no meio das requisições do job
+        self._executando = threading.Event()
+        # um worker só: duas compactações ao mesmo tempo criariam o mesmo zip
+        self.compactacao = ThreadPoolExecutor(max_workers=1)
+
+    # ---------- jobs ----------
+
+    def enfileirar(self, tipo, **params):
+        job = {
+            "id": next(self._ids),
+            "tipo": tipo,
+            "params": params,
+            "estado": "na_fila",
+            "criado_em": datetime.now().isoformat(timespec="seconds"),
+            "inicio": None,
+            "fim": None,
+            "arquivos": [],
+            "erro": None,
+        }
+        with self._lock:
+            self.jobs[job["id"]] = job
+            self._limpar_jobs_antigos()
+        self.fila.put(job)
+        print(f"[agendador] job {job['id']} ({tipo}) na fila: {params}")
+        return job
+
+    def _limpar_jobs_antigos(self):
+        finalizados = [
+            j["id"]
+            for j in self.jobs.values()
+            if j["estado"] in ("concluido", "falhou")
+        ]
+        for job_id in finalizados[:-MAX_JOBS_GUARDADOS]:
+            del self.jobs[job_id]
+
+    def consultar_job(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _loop_jobs(self):
+        while True:
+            job = self.fila.get()
+            job["estado"] = "executando"
+            job["inicio"] = datetime.now().isoformat(timespec="seconds")
+            self._executando.set()
+            try:
+                if job["tipo"] == "diario":
+                    self._executar_diario(job)
+                else:
+                    self._executar_backfill(job)
+                job["estado"] = "concluido"
+            except Exception as e:  # o serviço não pode cair por causa de um job
+                print(f"[agendador] job {job['id']} falhou: {e}")
+                job["estado"] = "falhou"
+                job["erro"] = str(e)
+            finally:
+                self._executando.clear()
+                job["fim"] = datetime.now().isoformat(timespec="seconds")
+
+            # daqui para baixo nada pode derrubar a thread dos jobs
+            try:
+                Requisicoes.salvar_historico_latencias(self.historico)
+            except Exception as e:
+                print(f"[agendador] erro ao salvar histórico de latências: {e}")
+
+            # compactação em segundo plano; o próximo job já pode começar
+            try:
+                self.compactacao.submit(self._compactar)
+            except Exception as e:
+                print(f"[agendador] erro ao agendar a compactação: {e}")
+
+    def _com_token_valido(self, montar):
+        """
+        Roda montar(logadas, somente=None). As empresas que voltarem com
+        "Token inválido" são buscadas de novo (só elas, somente=conjunto)
+        depois de um novo login, até MAX_RELOGINS_POR_DATA vezes.
+        """
+        resultado = montar(self.sessoes.obter(), None)
+        for _ in range(MAX_RELOGINS_POR_DATA):
+            invalidas = empresas_com_token_invalido(resultado)
+            if not invalidas:
+                break
+            print(
+                f"[agendador] token inválido em {len(invalidas)} empresas, "
+                "refazendo login e buscando de novo só elas..."
+            )
+            self.sessoes.invalidar()
+            parcial = montar(self.sessoes.obter(), invalidas)
+            resultado["empresas"].update(parcial["empresas"])
+        return resultado
+
+    def _executar_diario(self, job):
+        data_consulta = Backup_Cittati.parse_data(job["params"]["data"])
+
+        def montar(logadas, somente):
+            if len(logadas) > 1:
+                return Diario.montar_backup_multicontas(
+                    logadas, data_consulta, self.historico, somente=somente
+                )
+            _, session, token, empresas = logadas[0]
+            if somente is not None:
+                empresas = [e for e in empresas if e in somente]
+            return Diario.montar_backup_diario(
+                session, token, empresas, data_consulta, historico=self.historico
+            )
+
+        resultado = self._com_token_valido(montar)
+        Diario.salvar_backup(resultado, data_consulta)
+        job["arquivos"].append(f"backup_cittati_{data_consulta:%Y%m%d}.txt")
+
+    def _executar_backfill(self, job):
+        params = job["params"]
+        empresa_param = params["empresa"]
+        linha = params["linha"]
+        todas = empresa_param.lower() in ("todas", "all", "")
+        sufixo = Backup_Cittati.montar_sufixo_arquivo(empresa_param, linha)
+
+        def montar(logadas, somente, data_consulta):
+            if todas:
+                distribuicao = Diario.distribuir_empresas(logadas)
+                partes = [
+                    (logadas[i], [e for e in empresas if somente is None or e in somente])
+                    for i, empresas in distribuicao.items()
+                ]
+                partes = [(conta, empresas) for conta, empresas in partes if empresas]
+            else:
+                # usa a conta que enxerga a empresa (ou a primeira)
+                conta = next(
+                    (item for item in logadas if empresa_param in item[3]), logadas[0]
+                )
+                partes = [(conta, [empresa_param])]
+
+            resultado = {
+                "data": data_consulta.strftime("%Y-%m-%d"),
+                "linha": linha or "todas",
+                "empresas": {},
+            }
+            for (_, session, token, _), empresas in partes:
+                parcial = Backup_Cittati.montar_backup(
+                    session, token, empresas, data_consulta, linha, self.historico
+                )
+                resultado["empresas"].update(parcial["empresas"])
+            return resultado
+
+        datas = Backup_Cittati.gerar_intervalo_datas(
+            Backup_Cittati.parse_data(params["inicio"]),
+            Backup_Cittati.parse_data(params["fim"]),
+        )
+        for data_consulta in datas:
+            resultado = self._com_token_valido(
+                lambda logadas, somente: montar(logadas, somente, data_consulta)
+            )
+            Backup_Cittati.salvar_backup(resultado, data_consulta, sufixo=sufixo)
+            job["arquivos"].append(
+                f"backup_cittati_{data_consulta:%Y%m%d}_{sufixo}.txt"
+            )
+
+    def _compactar(self):
+        try:
+            Diario.compacta_backups_em_lotes()
+        except Exception as e:
+            print(f"[agendador] erro na compactação: {e}")
+
+    # ---------- agenda e sessão ----------
+
+    def _loop_agenda(self):
+        while True:
+            self.proximo_diario = proximo_horario(self.hora_diario, datetime.now())
+            print(f"[agendador] próximo backup diário: {self.proximo_diario}")
+            # dorme em pedaços para acompanhar ajuste de relógio
+            while datetime.now() < self.proximo_diario:
+                restante = (self.proximo_diario - datetime.now()).total_seconds()
+                time.sleep(max(0.0, min(restante, 60)))
+            ontem = datetime.now() - timedelta(days=1)
+            self.enfileirar("diario", data=ontem.strftime("%Y%m%d"))
+
+    def _loop_manter_quente(self):
+        while True:
+            time.sleep(INTERVALO_MANTER_QUENTE)
+            if self._executando.is_set():
+                # o job renova o login (se precisar) entre uma data e outra
+                continue
+            try:
+                self.sessoes.obter()
+            except Exception as e:
+                print(f"[agendador] falha ao renovar login: {e}")
+                self.sessoes.invalidar()
+
+    def iniciar(self):
+        for alvo in (self._loop_jobs, self._loop_agenda, self._loop_manter_quente):
+            threading.Thread(target=alvo, daemon=True).start()
+
+    def status(self):
+        with self._lock:
+            jobs = sorted(self.jobs.values(), key=lambda j: j["id"], reverse=True)
+            resumo = [
+                {k: j[k] for k in ("id", "tipo", "estado", "criado_em", "fim")}
+                for j in jobs[:20]
+            ]
+        return {
+            "proximo_diario": (
+                self.proximo_diario.isoformat(timespec="seconds")
+                if self.proximo_diario
+                else None
+            ),
+            "login_ha_segundos": (
+                round(time.monotonic() - self.sessoes.logado_em)
+                if self.sessoes.logado_em is not None
+                else None
+            ),
+            "contas_sem_login": self.sessoes.sem_login,
+            "jobs_na_fila": self.fila.qsize(),
+            "jobs": resumo,
+        }
+
+
+# ================== HTTP ==================
+
+
+def data_do_pedido(valor, campo):
+    """
+    Data vinda do JSON: texto ou número ({"data": 20251123}).
+    Outros tipos levantam ValueError (vira 400).
+    """
+    if isinstance(valor, bool) or not isinstance(valor, (str, int)):
+        raise ValueError(f'"{campo}" deve ser texto ou número (ex: 20251123).')
+    return str(valor)
+
+
+def texto_do_pedido(corpo, campo):
+    """
+    empresa/linha vindas do JSON: só texto, sem separador de pasta (o valor
+    vai para o nome do arquivo). Ausente ou vazio → "todas".
+    """
+    valor = corpo.get(campo)
+    if valor is None:
+        return "todas"
+    if not isinstance(valor, str):
+        raise ValueError(f'"{campo}" deve ser texto.')
+    if "/" in valor or "\\" in valor:
+        raise ValueError(f'"{campo}" não pode conter / ou \\.')
+    return valor or "todas"
+
+
+def validar_pedido_backfill(corpo):
+    """
+    Normaliza o JSON do POST /backfill. Levanta ValueError se inválido.
+    Datas podem vir como texto ou número ({"data": 20251123}).
+    """
+    if corpo.get("data"):
+        inicio = fim = data_do_pedido(corpo["data"], "data")
+    elif corpo.get("inicio") and corpo.get("fim"):
+        inicio = data_do_pedido(corpo["inicio"], "inicio")
+        fim = data_do_pedido(corpo["fim"], "fim")
+    else:
+        raise ValueError('Informe "data" ou "inicio" e "fim".')
+
+    # valida o formato já aqui, para o erro voltar na resposta HTTP
+    if Backup_Cittati.parse_data(fim) < Backup_Cittati.parse_data(inicio):
+        raise ValueError("fim não pode ser menor que inicio.")
+
+    linha = texto_do_pedido(corpo, "linha")
+    return {
+        "inicio": inicio,
+        "fim": fim,
+        "empresa": texto_do_pedido(corpo, "empresa"),
+        "linha": None if linha.lower() in ("todas", "all", "") else linha,
+    }
+
+
+class TratadorHTTP(BaseHTTPRequestHandler):
+    """Endpoints do agendador (ver docstring do módulo)."""
+
+    def _responder(self, status, corpo):
+        dados = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _ler_json(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        if not tamanho:
+            return {}
+        corpo = json.loads(self.rfile.read(tamanho))
+        if not isinstance(corpo, dict):
+            raise ValueError("O corpo deve ser um objeto JSON.")
+        return corpo
+
+    def do_GET(self):
+        agendador = self.server.agendador
+        if self.path == "/status":
+            self._responder(200, agendador.status())
+        elif self.path.startswith("/jobs/"):
+            try:
+                job = agendador.consultar_job(int(self.path[len("/jobs/"):]))
+            except ValueError:
+                job = None
+            if job is None:
+                self._responder(404, {"erro": "job não encontrado"})
+            else:
+                self._responder(200, job)
+        else:
+            self._responder(404, {"erro": "rota não encontrada"})
+
+    def do_POST(self):
+        agendador = self.server.agendador
+        try:
+            corpo = self._ler_json()
+            if self.path == "/backfill":
+                job = agendador.enfileirar("backfill", **validar_pedido_backfill(corpo))
+            elif self.path == "/diario":
+                data = data_do_pedido(
+                    corpo.get("data")
+                    or (datetime.now() - timedelta(days=1)).strftime("%Y%m%d"),
+                    "data",
+                )
+                Backup_Cittati.parse_data(data)
+                job = agendador.enfileirar("diario", data=data)
+            else:
+                self._responder(404, {"erro": "rota não encontrada"})
+                return
+        except (ValueError, TypeError) as e:
+            self._responder(400, {"erro": str(e)})
+            return
+        self._responder(202, job)
+
+    def log_message(self, formato, *args):
+        print(f"[http] {self.address_string()} {formato % args}")
+
+
+# ================== PARSE DE ARGUMENTOS ==================
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Agendador Cittati - serviço com backup diário e jobs sob demanda."
+    )
+    parser.add_argument(
+        "--hora",
+        default=HORA_DIARIO,
+        help=f"Horário do backup diário, HH:MM (padrão: {HORA_DIARIO})",
+    )
+    parser.add_argument(
+        "--host",
+        default=HOST,
+        help=f"Endereço do endpoint HTTP (padrão: {HOST})",
+    )
+    parser.add_argument(
+        "--porta",
+        type=int,
+        default=PORTA,
+        help=f"Porta do endpoint HTTP (padrão: {PORTA})",
+    )
+    return parser.parse_args()
+
+
+# ================== MAIN ==================
+
+
+def main():
+    args = parse_args()
+    try:
+        proximo_horario(args.hora, datetime.now())
+    except ValueError:
+        raise SystemExit(f"Horário inválido: {args.hora} (use HH:MM)")
+
+    contas = Diario.carregar_contas(Diario.CONTAS_ARQ) if Diario.CONTAS_ARQ else None
+    agendador = Agendador(args.hora, contas)
+
+    # login logo na subida: o primeiro job já encontra a sessão pronta
+    agendador.sessoes.obter()
+    agendador.iniciar()
+
+    servidor = ThreadingHTTPServer((args.host, args.porta), TratadorHTTP)
+    servidor.agendador = agendador
+    print(f"[agendador] ouvindo em http://{args.host}:{args.porta}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[agendador] encerrando...")
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,19 @@
 import os
 import sys
-import json
-import time
 from datetime import datetime, timedelta
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import argparse
 
+from Compactador import gravar_backup_atomico
+from Perfil import perfil
+from Requisicoes import (
+    criar_sessao_com_retry,
+    carregar_historico_latencias,
+    salvar_historico_latencias,
+    get_adaptativo,
+    buscar_com_retentativas,
+)
+
 
 # ================== CONFIGURAÇÕES ==================
 
@@ -32,24 +37,9 @@ TIMEOUT = 180
 MAX_TENTATIVAS = 3
 BACKUP_DIR = "backups_cittati"
 
-
 # ================== FUNÇÕES AUXILIARES ==================
 
 
-def criar_sessao_com_retry():
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=5,
-        backoff_factor=2,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS", "POST"],
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    return session
-
-
 def parse_data(texto):
     """Aceita: YYYYMMDD, DD/MM/YYYY, YYYY-MM-DD."""
     for fmt in ("%Y%m%d", "%d/%m/%Y", "%Y-%m-%d"):
@@ -73,10 +63,11 @@ def gerar_intervalo_datas(data_inicio, data_fim):
 def obter_identificacao_login(session):
     params = {"usuario": USUARIO, "senha": SENHA}
     print(f"Fazendo login em {LOGIN_URL} ...")
-    resp = session.post(LOGIN_URL, params=params, timeout=TIMEOUT)
-    resp.raise_for_status()
+    with perfil.etapa("login"):
+        resp = session.post(LOGIN_URL, params=params, timeout=TIMEOUT)
+        resp.raise_for_status()
 
-    dados = resp.json()
+        dados = resp.json()
     token = dados["identificacaoLogin"]
     empresas = dados.get("empresas", [])
 
@@ -84,10 +75,15 @@ def obter_identificacao_login(session):
     return token, empresas
 
 
-def buscar_dados_empresa(session, token, empresa, data_consulta, linha=None):
+def buscar_dados_empresa(
+    session, token, empresa, data_consulta, linha=None, historico=None, tentativa=1
+):
     """
     Consulta os dados da empresa para a data indicada.
     linha = None → todas as linhas.
+    historico = dict de latências (ver carregar_historico_latencias); se
+    informado, o timeout e o hedge são calculados por empresa e a medição
+    desta chamada é registrada nele. tentativa > 1 aumenta o timeout.
     """
     data_str = data_consulta.strftime("%Y%m%d")  # ex: 20251123
 
@@ -109,7 +105,23 @@ def buscar_dados_empresa(session, token, empresa, data_consulta, linha=None):
 
     print(f"  -> Buscando empresa={empresa} data={data_str} linha={linha or 'TODAS'} ...")
 
-    resp = session.get(DADOS_URL, params=params, headers=headers, timeout=TIMEOUT)
+    with perfil.etapa("rede", empresa=empresa):
+        if historico is None:
+            resp = session.get(
+                DADOS_URL, params=params, headers=headers, timeout=TIMEOUT
+            )
+        else:
+            resp = get_adaptativo(
+                session,
+                DADOS_URL,
+                params,
+                headers,
+                historico,
+                empresa,
+                TIMEOUT,
+                tentativa=tentativa,
+                linha=linha,
+            )
 
     # DEBUG opcional: descomente se quiser ver a URL e headers
     # print("     URL chamada:", resp.request.url)
@@ -122,7 +134,8 @@ def buscar_dados_empresa(session, token, empresa, data_consulta, linha=None):
     resp.raise_for_status()
 
     try:
-        dados = resp.json()
+        with perfil.etapa("resp.json", empresa=empresa):
+            dados = resp.json()
     except ValueError:
         print("     Atenção: resposta não é JSON puro. Texto bruto (até 1000 chars):")
         print(resp.text[:1000])
@@ -143,12 +156,58 @@ def salvar_backup(estrutura_json, data_consulta, sufixo=""):
     else:
         caminho = os.path.join(BACKUP_DIR, f"backup_cittati_{data_str}.txt")
 
-    with open(caminho, "w", encoding="utf-8") as f:
-        json.dump(estrutura_json, f, ensure_ascii=False, indent=2)
+    with perfil.etapa("json.dump"):
+        gravar_backup_atomico(estrutura_json, caminho)
 
     print(f"\nBackup salvo em: {caminho}")
 
 
+def montar_sufixo_arquivo(empresa_param, linha):
+    """Sufixo do nome do arquivo: <empresa|todas_empresas>_<linha|todas_linhas>."""
+    if empresa_param.lower() in ("todas", "all", ""):
+        sufixo_emp = "todas_empresas"
+    else:
+        sufixo_emp = empresa_param.replace("@", "_").replace(".", "_")
+    sufixo_linha = "todas_linhas" if linha is None else f"linha_{linha}"
+    return f"{sufixo_emp}_{sufixo_linha}"
+
+
+def montar_backup(session, token, empresas, data_consulta, linha, historico=None):
+    """
+    Busca todas as empresas para uma data (com retentativas) e devolve a
+    estrutura que vai para o arquivo de backup.
+    """
+    data_iso = data_consulta.strftime("%Y-%m-%d")
+    print(f"\n======================")
+    print(f"Processando data: {data_iso}")
+    print(f"Empresas: {empresas}")
+    print(f"Linha: {linha or 'TODAS'}")
+    print(f"======================\n")
+
+    resultado = {
+        "data": data_iso,
+        "linha": linha or "todas",
+        "empresas": {},
+    }
+
+    for empresa in empresas:
+        resultado["empresas"][empresa] = buscar_com_retentativas(
+            lambda tentativa: buscar_dados_empresa(
+                session,
+                token,
+                empresa,
+                data_consulta,
+                linha=linha,
+                historico=historico,
+                tentativa=tentativa,
+            ),
+            empresa,
+            MAX_TENTATIVAS,
+        )
+
+    return resultado
+
+
 # ================== PARSE DE ARGUMENTOS ==================
 
 
@@ -179,6 +238,16 @@ def parse_args():
         default="todas",
         help='Código da linha (ex: 301C). Use "todas" para todas as linhas.',
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Mede tempo/CPU/memória por etapa e imprime o ranking no fim.",
+    )
+    parser.add_argument(
+        "--profile-saida",
+        metavar="ARQUIVO",
+        help="Com --profile, grava também um dump do cProfile (ex: backup.prof).",
+    )
 
     return parser.parse_args()
 
@@ -186,9 +255,7 @@ def parse_args():
 # ================== MAIN ==================
 
 
-def main():
-    args = parse_args()
-
+def executar_backup(args):
     # Datas
     if args.data:
         data_unica = parse_data(args.data)
@@ -209,59 +276,33 @@ def main():
 
     session = criar_sessao_com_retry()
     token, empresas_login = obter_identificacao_login(session)
+    historico = carregar_historico_latencias()
 
     # Empresas que serão usadas
     if empresa_param.lower() in ("todas", "all", ""):
         empresas_selecionadas = empresas_login
-        sufixo_emp = "todas_empresas"
     else:
         empresas_selecionadas = [empresa_param]
-        sufixo_emp = empresa_param.replace("@", "_").replace(".", "_")
 
-    sufixo_linha = "todas_linhas" if linha is None else f"linha_{linha}"
-    sufixo_arquivo = f"{sufixo_emp}_{sufixo_linha}"
+    sufixo_arquivo = montar_sufixo_arquivo(empresa_param, linha)
 
     # Loop por data
     for data_consulta in lista_datas:
-        data_iso = data_consulta.strftime("%Y-%m-%d")
-        print(f"\n======================")
-        print(f"Processando data: {data_iso}")
-        print(f"Empresas: {empresas_selecionadas}")
-        print(f"Linha: {linha or 'TODAS'}")
-        print(f"======================\n")
-
-        resultado = {
-            "data": data_iso,
-            "linha": linha or "todas",
-            "empresas": {},
-        }
-
-        for empresa in empresas_selecionadas:
-            for tentativa in range(1, MAX_TENTATIVAS + 1):
-                try:
-                    dados = buscar_dados_empresa(
-                        session, token, empresa, data_consulta, linha=linha
-                    )
-                    if dados is not None:
-                        resultado["empresas"][empresa] = dados
-                    else:
-                        resultado["empresas"][empresa] = []
-                    break
-                except (
-                    requests.Timeout,
-                    requests.ConnectionError,
-                    requests.RequestException,
-                ) as e:
-                    print(
-                        f"     Erro (tentativa {tentativa}/{MAX_TENTATIVAS}) "
-                        f"para empresa {empresa}: {e}"
-                    )
-                    time.sleep(5 * tentativa)
-            else:
-                print(f"     Falha definitiva para empresa {empresa}")
-                resultado["empresas"][empresa] = {"erro": "falha_apos_retentativas"}
-
+        resultado = montar_backup(
+            session, token, empresas_selecionadas, data_consulta, linha, historico
+        )
         salvar_backup(resultado, data_consulta, sufixo=sufixo_arquivo)
+        salvar_historico_latencias(historico)
+
+
+def main():
+    args = parse_args()
+    if args.profile or args.profile_saida:
+        perfil.iniciar(args.profile_saida)
+    try:
+        executar_backup(args)
+    finally:
+        perfil.finalizar()
 
 
 if __name__ == "__main__":
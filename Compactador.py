@@ -1,14 +1,40 @@
 # Compactador.py
 import os
 import re
+import sys
+import json
 import zipfile
+import threading
 from datetime import datetime, timedelta
 
+from Perfil import perfil, extrair_opcoes_perfil
+
 BACKUP_DIR = "backups_cittati"
 MIN_DIAS_SEQUENCIA = 10
 PADRAO_DATA = re.compile(r"backup_cittati_(\d{8})")
 
 
+def gravar_backup_atomico(estrutura_json, caminho):
+    """
+    Grava o JSON num arquivo temporário da mesma pasta e só então troca
+    pelo nome final (os.replace). Assim a compactação em segundo plano
+    nunca vê um backup pela metade. O nome temporário não casa com
+    PADRAO_DATA, então o compactador o ignora.
+    """
+    pasta = os.path.dirname(caminho) or "."
+    tmp = os.path.join(
+        pasta, f".gravando_{os.getpid()}_{threading.get_ident()}.tmp"
+    )
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(estrutura_json, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, caminho)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
 def listar_arquivos_por_data():
     """
     Retorna:
@@ -139,7 +165,8 @@ def compacta_backups_em_lotes():
     - cria um .zip para cada bloco de 10 dias
     - apaga os arquivos individuais que foram compactados
     """
-    arquivos_por_data, datas_ordenadas = listar_arquivos_por_data()
+    with perfil.etapa("listar_arquivos"):
+        arquivos_por_data, datas_ordenadas = listar_arquivos_por_data()
 
     if not datas_ordenadas:
         print("Nenhum arquivo de backup encontrado para compactar.")
@@ -157,10 +184,22 @@ def compacta_backups_em_lotes():
         print(f" - {b[0].strftime('%Y-%m-%d')} até {b[1].strftime('%Y-%m-%d')}")
 
     for data_inicio, data_fim in blocos:
-        criar_zip_do_bloco(arquivos_por_data, data_inicio, data_fim)
+        with perfil.etapa("zip"):
+            criar_zip_do_bloco(arquivos_por_data, data_inicio, data_fim)
 
     print("Compactação em lotes concluída.\n")
 
 
+def main():
+    # Uso: python Compactador.py [--profile] [--profile-saida ARQUIVO]
+    com_perfil, arquivo_cprofile, _ = extrair_opcoes_perfil(sys.argv[1:])
+    if com_perfil:
+        perfil.iniciar(arquivo_cprofile)
+    try:
+        compacta_backups_em_lotes()
+    finally:
+        perfil.finalizar()
+
+
 if __name__ == "__main__":
-    compacta_backups_em_lotes()
+    main()
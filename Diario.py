@@ -4,11 +4,21 @@ import json
 import time
 import re
 import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+from Compactador import gravar_backup_atomico
+from Perfil import perfil, extrair_opcoes_perfil
+from Requisicoes import (
+    criar_sessao_com_retry,
+    carregar_historico_latencias,
+    salvar_historico_latencias,
+    get_adaptativo,
+    buscar_com_retentativas,
+)
 
 
 # ================== CONFIGURAÇÕES ==================
@@ -29,6 +39,14 @@ DADOS_URL = (
 USUARIO = os.getenv("CITTATI_USUARIO", "sintram.ws")
 SENHA = os.getenv("CITTATI_SENHA", "4Eg_xyWa")
 
+# Várias contas num só backup: caminho de um JSON com a lista de contas
+#   [{"usuario": "...", "senha": "...",
+#     "max_simultaneas": 2, "intervalo_min": 1.0}, ...]
+# Se não estiver definido, usa só USUARIO/SENHA.
+CONTAS_ARQ = os.getenv("CITTATI_CONTAS")
+MAX_SIMULTANEAS_POR_CONTA = 2   # requisições ao mesmo tempo por conta
+INTERVALO_MIN_POR_CONTA = 1.0   # segundos entre inícios de requisição da conta
+
 # Tempo máximo de espera por requisição
 TIMEOUT = 180
 MAX_TENTATIVAS = 3
@@ -47,29 +65,16 @@ PADRAO_DATA = re.compile(r"backup_cittati_(\d{8})")
 # ================== FUNÇÕES AUXILIARES HTTP ==================
 
 
-def criar_sessao_com_retry():
-    """Cria sessão requests com retry automático."""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=5,
-        backoff_factor=2,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS", "POST"],
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    return session
-
-
-def parse_data_argumento():
+def parse_data_argumento(argv=None):
     """
-    Lê a data da linha de comando.
+    Lê a data da linha de comando (ou de argv, sem o nome do script).
     Aceita: YYYYMMDD, DD/MM/YYYY, YYYY-MM-DD.
     Se nada for passado, usa DIA ANTERIOR.
     """
-    if len(sys.argv) >= 2:
-        txt = sys.argv[1]
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) >= 1:
+        txt = argv[0]
         for fmt in ("%Y%m%d", "%d/%m/%Y", "%Y-%m-%d"):
             try:
                 return datetime.strptime(txt, fmt)
@@ -83,17 +88,19 @@ def parse_data_argumento():
         return datetime.now() - timedelta(days=1)
 
 
-def obter_identificacao_login(session):
+def obter_identificacao_login(session, usuario=None, senha=None):
     """
     Faz o POST de login e retorna (identificacaoLogin, lista_empresas).
     Usa o mesmo esquema que você tem no Postman: params usuario/senha.
+    Sem usuario/senha, usa USUARIO/SENHA.
     """
-    params = {"usuario": USUARIO, "senha": SENHA}
+    params = {"usuario": usuario or USUARIO, "senha": senha or SENHA}
     print(f"Fazendo login em {LOGIN_URL} ...")
-    resp = session.post(LOGIN_URL, params=params, timeout=TIMEOUT)
-    resp.raise_for_status()
+    with perfil.etapa("login"):
+        resp = session.post(LOGIN_URL, params=params, timeout=TIMEOUT)
+        resp.raise_for_status()
 
-    dados = resp.json()
+        dados = resp.json()
 
     token = dados["identificacaoLogin"]
     empresas = dados.get("empresas", [])
@@ -102,11 +109,18 @@ def obter_identificacao_login(session):
     return token, empresas
 
 
-def buscar_dados_empresa(session, token, empresa, data_consulta):
+def buscar_dados_empresa(
+    session, token, empresa, data_consulta, historico=None, tentativa=1, hedge=True
+):
     """
     Consulta os dados da empresa para a data indicada.
     Retorna o JSON da resposta (ou None se vazio / 204).
 
+    Se historico (ver carregar_historico_latencias) for informado, o timeout
+    e o hedge são calculados por empresa e a medição é registrada nele.
+    tentativa > 1 aumenta o timeout (ver timeout_da_tentativa).
+    hedge=False desliga a requisição duplicada.
+
     Aqui a gente manda o token de TODOS os jeitos prováveis:
       - query param identificacaoLogin
       - query param token
@@ -131,7 +145,23 @@ def buscar_dados_empresa(session, token, empresa, data_consulta):
 
     print(f"  -> Buscando empresa={empresa} data={data_str} ...")
 
-    resp = session.get(DADOS_URL, params=params, headers=headers, timeout=TIMEOUT)
+    with perfil.etapa("rede", empresa=empresa):
+        if historico is None:
+            resp = session.get(
+                DADOS_URL, params=params, headers=headers, timeout=TIMEOUT
+            )
+        else:
+            resp = get_adaptativo(
+                session,
+                DADOS_URL,
+                params,
+                headers,
+                historico,
+                empresa,
+                TIMEOUT,
+                tentativa=tentativa,
+                hedge=hedge,
+            )
 
     # DEBUG: mostra a URL e headers que realmente foram enviados
     print("     URL chamada:", resp.request.url)
@@ -144,7 +174,8 @@ def buscar_dados_empresa(session, token, empresa, data_consulta):
     resp.raise_for_status()
 
     try:
-        dados = resp.json()
+        with perfil.etapa("resp.json", empresa=empresa):
+            dados = resp.json()
     except ValueError:
         print("     Atenção: resposta não é JSON puro. Texto bruto (até 1000 chars):")
         print(resp.text[:1000])
@@ -157,14 +188,41 @@ def buscar_dados_empresa(session, token, empresa, data_consulta):
     return dados
 
 
+def buscar_empresa_com_retentativas(
+    session, token, empresa, data_consulta, historico=None, limitador=None
+):
+    """
+    buscar_dados_empresa com até MAX_TENTATIVAS tentativas.
+    Retorna o que vai no backup para a empresa (dados, [] ou erro).
+    limitador (LimitadorConta) segura o ritmo de requisições da conta; com
+    ele o hedge fica desligado, pois a requisição duplicada passaria por
+    fora de max_simultaneas e intervalo_min.
+    """
+
+    def buscar(tentativa):
+        if limitador is not None:
+            limitador.aguardar_vez()
+        return buscar_dados_empresa(
+            session,
+            token,
+            empresa,
+            data_consulta,
+            historico=historico,
+            tentativa=tentativa,
+            hedge=limitador is None,
+        )
+
+    return buscar_com_retentativas(buscar, empresa, MAX_TENTATIVAS)
+
+
 def salvar_backup(estrutura_json, data_consulta):
     """Salva o dicionário em arquivo .txt no formato JSON."""
     os.makedirs(BACKUP_DIR, exist_ok=True)
     data_str = data_consulta.strftime("%Y%m%d")
     caminho = os.path.join(BACKUP_DIR, f"backup_cittati_{data_str}.txt")
 
-    with open(caminho, "w", encoding="utf-8") as f:
-        json.dump(estrutura_json, f, ensure_ascii=False, indent=2)
+    with perfil.etapa("json.dump"):
+        gravar_backup_atomico(estrutura_json, caminho)
 
     print(f"\nBackup salvo em: {caminho}")
 
@@ -281,7 +339,8 @@ def compacta_backups_em_lotes():
     - encontra blocos de 10 dias consecutivos
     - cria um .zip para cada bloco de 10 dias
     """
-    arquivos_por_data, datas_ordenadas = listar_arquivos_por_data()
+    with perfil.etapa("listar_arquivos"):
+        arquivos_por_data, datas_ordenadas = listar_arquivos_por_data()
 
     if not datas_ordenadas:
         print("Nenhum arquivo de backup encontrado para compactar.")
@@ -299,7 +358,8 @@ def compacta_backups_em_lotes():
         print(f" - {b[0].strftime('%Y-%m-%d')} até {b[1].strftime('%Y-%m-%d')}")
 
     for data_inicio, data_fim in blocos:
-        criar_zip_do_bloco(arquivos_por_data, data_inicio, data_fim)
+        with perfil.etapa("zip"):
+            criar_zip_do_bloco(arquivos_por_data, data_inicio, data_fim)
 
     print("Compactação em lotes concluída.\n")
 
@@ -307,8 +367,21 @@ def compacta_backups_em_lotes():
 # ================== MAIN ==================
 
 
-def main():
-    data_consulta = parse_data_argumento()
+def montar_backup_diario(session, token, empresas, data_consulta, historico=None):
+    """Busca todas as empresas do dia e devolve a estrutura do backup."""
+    resultado = {
+        "data": data_consulta.strftime("%Y-%m-%d"),
+        "empresas": {},  # chave = empresa (email), valor = dados da API
+    }
+
+    for empresa in empresas:
+        resultado["empresas"][empresa] = buscar_empresa_com_retentativas(
+            session, token, empresa, data_consulta, historico=historico
+        )
+    return resultado
+
+
+def executar_diario(data_consulta):
     data_iso = data_consulta.strftime("%Y-%m-%d")
     print(f"Data de referência: {data_iso}")
 
@@ -316,43 +389,204 @@ def main():
 
     # 1) LOGIN → token + lista de empresas
     token, empresas = obter_identificacao_login(session)
+    historico = carregar_historico_latencias()
+
+    # 2) Para cada empresa, buscar os dados do dia
+    resultado = montar_backup_diario(
+        session, token, empresas, data_consulta, historico=historico
+    )
+
+    # 3) Salvar backup em TXT (JSON)
+    salvar_backup(resultado, data_consulta)
+    salvar_historico_latencias(historico)
+
+    # 4) Verificar se já existem 10 dias consecutivos e compactar
+    compacta_backups_em_lotes()
+
+
+# ================== VÁRIAS CONTAS ==================
+
+
+class LimitadorConta:
+    """Garante um intervalo mínimo entre requisições da mesma conta."""
+
+    def __init__(self, intervalo_min):
+        self.intervalo_min = intervalo_min
+        self._lock = threading.Lock()
+        self._proxima = 0.0
+
+    def aguardar_vez(self):
+        with self._lock:
+            agora = time.monotonic()
+            inicio = max(agora, self._proxima)
+            self._proxima = inicio + self.intervalo_min
+        if inicio > agora:
+            time.sleep(inicio - agora)
+
+
+def carregar_contas(caminho):
+    """Lê o JSON de contas (ver CONTAS_ARQ) e valida os campos."""
+    try:
+        with open(caminho, "r", encoding="utf-8") as f:
+            contas = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Não foi possível ler o arquivo de contas {caminho}: {e}")
+
+    if not isinstance(contas, list) or not contas:
+        raise SystemExit(f"{caminho} deve conter uma lista de contas.")
+    for i, conta in enumerate(contas):
+        if not isinstance(conta, dict) or not (
+            conta.get("usuario") and conta.get("senha")
+        ):
+            raise SystemExit(f"Conta #{i + 1} de {caminho} sem usuario/senha.")
+    return contas
+
+
+def login_contas(contas):
+    """
+    Faz login em todas as contas ao mesmo tempo.
+    Retorna lista de (conta, session, token, empresas) das contas que logaram.
+    """
+
+    def login(conta):
+        session = criar_sessao_com_retry()
+        token, empresas = obter_identificacao_login(
+            session, conta["usuario"], conta["senha"]
+        )
+        return conta, session, token, empresas
+
+    logadas = []
+    with ThreadPoolExecutor(max_workers=len(contas)) as pool:
+        futuros = {pool.submit(login, conta): conta for conta in contas}
+        for fut in as_completed(futuros):
+            try:
+                logadas.append(fut.result())
+            except (requests.RequestException, KeyError, ValueError) as e:
+                print(f"Falha no login da conta {futuros[fut]['usuario']}: {e}")
+
+    # mantém a ordem do arquivo de contas
+    ordem = {id(conta): i for i, conta in enumerate(contas)}
+    logadas.sort(key=lambda item: ordem[id(item[0])])
+    return logadas
+
+
+def distribuir_empresas(logadas):
+    """
+    Junta as empresas de todas as contas sem repetir. Empresa que aparece
+    em mais de uma conta vai para a conta com menos empresas até o momento.
+    Retorna {indice_conta: [empresas]}.
+    """
+    contas_por_empresa = {}
+    for i, (_, _, _, empresas) in enumerate(logadas):
+        for empresa in empresas:
+            contas_por_empresa.setdefault(empresa, []).append(i)
+
+    distribuicao = {i: [] for i in range(len(logadas))}
+    # primeiro as empresas com menos opções de conta
+    ordenadas = sorted(contas_por_empresa.items(), key=lambda kv: len(kv[1]))
+    for empresa, indices in ordenadas:
+        escolhida = min(indices, key=lambda i: len(distribuicao[i]))
+        distribuicao[escolhida].append(empresa)
+    return distribuicao
+
+
+def montar_backup_multicontas(logadas, data_consulta, historico=None, somente=None):
+    """
+    Busca as empresas de todas as contas logadas (ver login_contas) em
+    paralelo e devolve a estrutura do backup, igual à do montar_backup_diario.
+    somente = conjunto de empresas a buscar (None → todas as das contas).
+    """
+    distribuicao = distribuir_empresas(logadas)
+    if somente is not None:
+        distribuicao = {
+            i: [e for e in empresas if e in somente]
+            for i, empresas in distribuicao.items()
+        }
+    total_empresas = sum(len(e) for e in distribuicao.values())
+    print(f"{total_empresas} empresas distintas em {len(logadas)} contas.")
 
-    # Estrutura final do backup
     resultado = {
-        "data": data_iso,
-        "empresas": {},  # chave = empresa (email), valor = dados da API
+        "data": data_consulta.strftime("%Y-%m-%d"),
+        "empresas": {},
     }
 
-    # 2) Para cada empresa, buscar os dados do dia
-    for empresa in empresas:
-        for tentativa in range(1, MAX_TENTATIVAS + 1):
-            try:
-                dados = buscar_dados_empresa(session, token, empresa, data_consulta)
-                if dados is not None:
-                    resultado["empresas"][empresa] = dados
-                else:
-                    resultado["empresas"][empresa] = []
-                break
-            except (
-                requests.Timeout,
-                requests.ConnectionError,
-                requests.RequestException,
-            ) as e:
-                print(
-                    f"     Erro (tentativa {tentativa}/{MAX_TENTATIVAS}) "
-                    f"para empresa {empresa}: {e}"
+    # 2) Um pool por conta: o tamanho do pool é o limite de simultâneas
+    perfil.modo_threads()
+    pools = []
+    futuros = {}
+    try:
+        for i, (conta, session, token, _) in enumerate(logadas):
+            empresas = distribuicao[i]
+            if not empresas:
+                continue
+            pool = ThreadPoolExecutor(
+                max_workers=conta.get("max_simultaneas", MAX_SIMULTANEAS_POR_CONTA)
+            )
+            pools.append(pool)
+            limitador = LimitadorConta(
+                conta.get("intervalo_min", INTERVALO_MIN_POR_CONTA)
+            )
+            print(f"Conta {conta['usuario']}: {len(empresas)} empresas")
+            for empresa in empresas:
+                fut = pool.submit(
+                    buscar_empresa_com_retentativas,
+                    session,
+                    token,
+                    empresa,
+                    data_consulta,
+                    historico,
+                    limitador,
                 )
-                time.sleep(5 * tentativa)
-        else:
-            print(f"     Falha definitiva para empresa {empresa}")
-            resultado["empresas"][empresa] = {"erro": "falha_apos_retentativas"}
+                futuros[fut] = empresa
+
+        for fut in as_completed(futuros):
+            resultado["empresas"][futuros[fut]] = fut.result()
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=True)
+
+    # mesma ordem de empresas em toda execução
+    resultado["empresas"] = dict(sorted(resultado["empresas"].items()))
+    return resultado
+
+
+def executar_diario_multicontas(data_consulta, contas):
+    """Mesmo backup do executar_diario, buscando por várias contas em paralelo."""
+    data_iso = data_consulta.strftime("%Y-%m-%d")
+    print(f"Data de referência: {data_iso}")
+    print(f"Modo várias contas: {len(contas)} contas em {CONTAS_ARQ}")
+
+    # 1) LOGIN em todas as contas
+    logadas = login_contas(contas)
+    if not logadas:
+        raise SystemExit("Nenhuma conta conseguiu fazer login.")
+
+    # 2) Buscar as empresas de todas as contas
+    historico = carregar_historico_latencias()
+    resultado = montar_backup_multicontas(logadas, data_consulta, historico)
 
     # 3) Salvar backup em TXT (JSON)
     salvar_backup(resultado, data_consulta)
+    salvar_historico_latencias(historico)
 
     # 4) Verificar se já existem 10 dias consecutivos e compactar
     compacta_backups_em_lotes()
 
 
+def main():
+    # Uso: python Diario.py [DATA] [--profile] [--profile-saida ARQUIVO]
+    com_perfil, arquivo_cprofile, argv = extrair_opcoes_perfil(sys.argv[1:])
+    data_consulta = parse_data_argumento(argv)
+    if com_perfil:
+        perfil.iniciar(arquivo_cprofile)
+    try:
+        if CONTAS_ARQ:
+            executar_diario_multicontas(data_consulta, carregar_contas(CONTAS_ARQ))
+        else:
+            executar_diario(data_consulta)
+    finally:
+        perfil.finalizar()
+
+
 if __name__ == "__main__":
     main()
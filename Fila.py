@@ -0,0 +1,487 @@
+# Fila.py
+"""
+Fila de trabalho com lease (SQLite) para dividir backfills entre vários
+processos / máquinas.
+
+Cada item da fila é um par (data, empresa, linha). O coordenador cria os
+itens; cada worker pega um item com lease (prazo de posse), busca os dados
+e grava o resultado em BACKUP_DIR no mesmo formato do Backup_Cittati.py.
+Se um worker morrer, o lease expira e outro worker retoma o item.
+
+Exemplos:
+  python Fila.py criar --inicio-fim 20251101 20251130 --empresa todas --linha todas
+  python Fila.py worker --processos 4
+  python Fila.py status
+
+Para rodar em várias máquinas, o arquivo da fila (--db) precisa estar num
+sistema de arquivos compartilhado com lock de arquivo funcionando.
+"""
+import os
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+
+import requests
+
+from Backup_Cittati import (
+    BACKUP_DIR,
+    MAX_TENTATIVAS,
+    parse_data,
+    gerar_intervalo_datas,
+    obter_identificacao_login,
+    buscar_dados_empresa,
+    salvar_backup,
+)
+from Requisicoes import (
+    RENOVAR_LOGIN_A_CADA,
+    criar_sessao_com_retry,
+    carregar_historico_latencias,
+    salvar_historico_latencias,
+    resposta_token_invalido,
+)
+
+
+# ================== CONFIGURAÇÕES ==================
+
+FILA_DB = os.path.join(BACKUP_DIR, "fila_cittati.sqlite3")
+
+# Tempo de posse de um item; o worker renova a cada LEASE_SEGUNDOS / 3
+LEASE_SEGUNDOS = 120
+
+# Espera máxima entre consultas quando não há item livre agora (lease de
+# outro worker ativo ou item esperando a hora de tentar de novo)
+INTERVALO_POLL = 15
+
+# Depois de uma falha de rede o item só volta a ser pego após
+# ESPERA_RETENTATIVA x tentativa segundos (mesma espera do Backup_Cittati)
+ESPERA_RETENTATIVA = 5
+
+# Linha "todas" é guardada como texto vazio (a coluna entra no UNIQUE)
+LINHA_TODAS = ""
+
+STATUS_PENDENTE = "pendente"
+STATUS_EM_ANDAMENTO = "em_andamento"
+STATUS_CONCLUIDO = "concluido"
+STATUS_FALHOU = "falhou"
+
+# "Token inválido" seguidos, mesmo após relogar, antes de contar como falha
+MAX_RELOGINS_SEGUIDOS = 3
+
+
+# ================== BANCO DA FILA ==================
+
+
+def conectar_fila(caminho_db):
+    """Abre o SQLite da fila (cria a tabela se não existir)."""
+    pasta = os.path.dirname(caminho_db)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+
+    # isolation_level=None → controlamos as transações (BEGIN IMMEDIATE)
+    conn = sqlite3.connect(caminho_db, timeout=60, isolation_level=None)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS itens (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            data        TEXT NOT NULL,
+            empresa     TEXT NOT NULL,
+            linha       TEXT NOT NULL,
+            status      TEXT NOT NULL,
+            worker      TEXT,
+            lease_ate   REAL,
+            tentativas  INTEGER NOT NULL DEFAULT 0,
+            disponivel_em  REAL NOT NULL DEFAULT 0,
+            erro        TEXT,
+            UNIQUE (data, empresa, linha)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_itens_status ON itens (status)")
+    return conn
+
+
+def enfileirar_itens(conn, datas, empresas, linha):
+    """Insere (data, empresa, linha); itens já existentes são mantidos."""
+    linha_db = linha or LINHA_TODAS
+    linhas = [
+        (d.strftime("%Y%m%d"), empresa, linha_db, STATUS_PENDENTE)
+        for d in datas
+        for empresa in empresas
+    ]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        antes = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO itens (data, empresa, linha, status) "
+            "VALUES (?, ?, ?, ?)",
+            linhas,
+        )
+        inseridos = conn.total_changes - antes
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return inseridos
+
+
+def pegar_item(conn, worker_id):
+    """
+    Pega o próximo item livre (pendente já disponível ou com lease vencido)
+    e marca com lease para este worker. Retorna (id, data, empresa, linha, tentativa)
+    ou None; tentativa já conta a posse atual.
+    """
+    agora = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # lease vencido e sem tentativas sobrando → desiste do item
+        conn.execute(
+            "UPDATE itens SET status = ?, erro = ?, lease_ate = NULL "
+            "WHERE status = ? AND lease_ate < ? AND tentativas >= ?",
+            (
+                STATUS_FALHOU,
+                "lease_expirado_apos_retentativas",
+                STATUS_EM_ANDAMENTO,
+                agora,
+                MAX_TENTATIVAS,
+            ),
+        )
+        row = conn.execute(
+            "SELECT id, data, empresa, linha, tentativas + 1 FROM itens "
+            "WHERE (status = ? AND disponivel_em <= ?) "
+            "OR (status = ? AND lease_ate < ?) "
+            "ORDER BY id LIMIT 1",
+            (STATUS_PENDENTE, agora, STATUS_EM_ANDAMENTO, agora),
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE itens SET status = ?, worker = ?, lease_ate = ?, "
+                "tentativas = tentativas + 1 WHERE id = ?",
+                (STATUS_EM_ANDAMENTO, worker_id, agora + LEASE_SEGUNDOS, row[0]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def renovar_lease(conn, item_id, worker_id):
+    """Estende o lease; retorna False se o item não é mais deste worker."""
+    cur = conn.execute(
+        "UPDATE itens SET lease_ate = ? "
+        "WHERE id = ? AND worker = ? AND status = ?",
+        (time.time() + LEASE_SEGUNDOS, item_id, worker_id, STATUS_EM_ANDAMENTO),
+    )
+    return cur.rowcount == 1
+
+
+def finalizar_item(conn, item_id, worker_id, status, erro=None, espera=0):
+    """
+    Marca o item como concluído / pendente de novo / falhou.
+    espera = segundos até o item (pendente) poder ser pego de novo.
+    """
+    conn.execute(
+        "UPDATE itens SET status = ?, erro = ?, lease_ate = NULL, "
+        "disponivel_em = ? WHERE id = ? AND worker = ?",
+        (status, erro, time.time() + espera, item_id, worker_id),
+    )
+
+
+def devolver_item(conn, item_id, worker_id):
+    """Volta o item para pendente sem gastar a tentativa (ex: token vencido)."""
+    conn.execute(
+        "UPDATE itens SET status = ?, erro = NULL, lease_ate = NULL, "
+        "tentativas = MAX(0, tentativas - 1) WHERE id = ? AND worker = ?",
+        (STATUS_PENDENTE, item_id, worker_id),
+    )
+
+
+def espera_proximo_item(conn):
+    """
+    Segundos até algum item poder ser pego (pendente aguardando a hora de
+    tentar de novo ou lease de outro worker vencendo), entre 1 e
+    INTERVALO_POLL. None → não há mais itens pendentes nem em andamento.
+    """
+    row = conn.execute(
+        "SELECT MIN(CASE WHEN status = ? THEN disponivel_em ELSE lease_ate END) "
+        "FROM itens WHERE status IN (?, ?)",
+        (STATUS_PENDENTE, STATUS_PENDENTE, STATUS_EM_ANDAMENTO),
+    ).fetchone()
+    if row[0] is None:
+        return None
+    return min(INTERVALO_POLL, max(1.0, row[0] - time.time()))
+
+
+def resumo_fila(conn):
+    """Retorna {status: quantidade}."""
+    return dict(
+        conn.execute("SELECT status, COUNT(*) FROM itens GROUP BY status").fetchall()
+    )
+
+
+# ================== WORKER ==================
+
+
+class TokenInvalido(Exception):
+    """A API respondeu 'Token inválido' (codigoErro 02) para o item."""
+
+
+class RenovadorLease:
+    """Thread que mantém o lease do item atual enquanto a busca roda."""
+
+    def __init__(self, caminho_db, item_id, worker_id):
+        self.caminho_db = caminho_db
+        self.item_id = item_id
+        self.worker_id = worker_id
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        # conexão própria: sqlite3 não compartilha conexão entre threads
+        conn = conectar_fila(self.caminho_db)
+        try:
+            while not self._parar.wait(LEASE_SEGUNDOS / 3):
+                if not renovar_lease(conn, self.item_id, self.worker_id):
+                    print(f"     [{self.worker_id}] lease do item {self.item_id} perdido")
+                    return
+        finally:
+            conn.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+
+def nome_sufixo(empresa, linha):
+    """Mesmo sufixo de arquivo usado pelo Backup_Cittati.py."""
+    sufixo_emp = empresa.replace("@", "_").replace(".", "_")
+    sufixo_linha = "todas_linhas" if not linha else f"linha_{linha}"
+    return f"{sufixo_emp}_{sufixo_linha}"
+
+
+def processar_item(session, token, historico, data_str, empresa, linha, tentativa=1):
+    """
+    Busca um item e grava o backup. Levanta RequestException em falha e
+    TokenInvalido se o token venceu (nada é gravado nesse caso).
+    tentativa > 1 aumenta o timeout da busca.
+    """
+    data_consulta = parse_data(data_str)
+    dados = buscar_dados_empresa(
+        session,
+        token,
+        empresa,
+        data_consulta,
+        linha=linha or None,
+        historico=historico,
+        tentativa=tentativa,
+    )
+    if resposta_token_invalido(dados):
+        raise TokenInvalido(dados)
+    resultado = {
+        "data": data_consulta.strftime("%Y-%m-%d"),
+        "linha": linha or "todas",
+        "empresas": {empresa: dados if dados is not None else []},
+    }
+    salvar_backup(resultado, data_consulta, sufixo=nome_sufixo(empresa, linha))
+
+
+def rodar_worker(caminho_db, worker_id):
+    """
+    Loop do worker: pega item, processa, marca como concluído.
+    Termina quando não há mais itens pendentes nem em andamento.
+    O login é refeito a cada RENOVAR_LOGIN_A_CADA segundos e quando a API
+    responde "Token inválido" (o item volta para pendente).
+    """
+    print(f"[{worker_id}] iniciando (fila: {caminho_db})")
+    conn = conectar_fila(caminho_db)
+    session = criar_sessao_com_retry()
+    token, _ = obter_identificacao_login(session)
+    logado_em = time.monotonic()
+    relogins_seguidos = 0
+    historico = carregar_historico_latencias()
+    processados = 0
+
+    try:
+        while True:
+            item = pegar_item(conn, worker_id)
+            if item is None:
+                espera = espera_proximo_item(conn)
+                if espera is None:
+                    break
+                # outros workers ainda trabalhando ou itens esperando nova
+                # tentativa; espera para retomá-los
+                time.sleep(espera)
+                continue
+
+            if time.monotonic() - logado_em > RENOVAR_LOGIN_A_CADA:
+                print(f"[{worker_id}] renovando login")
+                token, _ = obter_identificacao_login(session)
+                logado_em = time.monotonic()
+
+            item_id, data_str, empresa, linha, tentativa = item
+            print(f"[{worker_id}] item {item_id}: {data_str} {empresa} {linha or 'TODAS'}")
+
+            try:
+                with RenovadorLease(caminho_db, item_id, worker_id):
+                    processar_item(
+                        session, token, historico, data_str, empresa, linha, tentativa
+                    )
+            except TokenInvalido:
+                relogins_seguidos += 1
+                print(f"     [{worker_id}] Token inválido no item {item_id}, refazendo login")
+                if relogins_seguidos <= MAX_RELOGINS_SEGUIDOS:
+                    devolver_item(conn, item_id, worker_id)
+                else:
+                    status = (
+                        STATUS_FALHOU
+                        if tentativa >= MAX_TENTATIVAS
+                        else STATUS_PENDENTE
+                    )
+                    finalizar_item(
+                        conn,
+                        item_id,
+                        worker_id,
+                        status,
+                        erro="token_invalido",
+                        espera=ESPERA_RETENTATIVA * tentativa,
+                    )
+                token, _ = obter_identificacao_login(session)
+                logado_em = time.monotonic()
+                continue
+            except requests.RequestException as e:
+                status = (
+                    STATUS_FALHOU if tentativa >= MAX_TENTATIVAS else STATUS_PENDENTE
+                )
+                print(
+                    f"     [{worker_id}] Erro (tentativa {tentativa}/{MAX_TENTATIVAS}) "
+                    f"no item {item_id}: {e}"
+                )
+                finalizar_item(
+                    conn,
+                    item_id,
+                    worker_id,
+                    status,
+                    erro=str(e),
+                    espera=ESPERA_RETENTATIVA * tentativa,
+                )
+                continue
+
+            finalizar_item(conn, item_id, worker_id, STATUS_CONCLUIDO)
+            relogins_seguidos = 0
+            processados += 1
+    finally:
+        salvar_historico_latencias(historico)
+        conn.close()
+
+    print(f"[{worker_id}] fim. Itens processados: {processados}")
+
+
+def _rodar_worker_processo(caminho_db, indice):
+    rodar_worker(caminho_db, f"{socket.gethostname()}-{os.getpid()}-{indice}")
+
+
+# ================== PARSE DE ARGUMENTOS ==================
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fila Cittati - divide backfills entre vários workers."
+    )
+    parser.add_argument(
+        "--db",
+        default=FILA_DB,
+        help=f"Arquivo SQLite da fila (padrão: {FILA_DB})",
+    )
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_criar = sub.add_parser("criar", help="Cria os itens da fila")
+    group_data = p_criar.add_mutually_exclusive_group(required=True)
+    group_data.add_argument("--data", help="Data única (YYYYMMDD)")
+    group_data.add_argument(
+        "--inicio-fim",
+        nargs=2,
+        metavar=("DATA_INICIO", "DATA_FIM"),
+        help="Intervalo de datas (ex: 20251120 20251123)",
+    )
+    p_criar.add_argument(
+        "--empresa",
+        default="todas",
+        help='E-mail da empresa. Use "todas" para todas as empresas do login.',
+    )
+    p_criar.add_argument(
+        "--linha",
+        default="todas",
+        help='Código da linha (ex: 301C). Use "todas" para todas as linhas.',
+    )
+
+    p_worker = sub.add_parser("worker", help="Processa itens da fila")
+    p_worker.add_argument(
+        "--processos",
+        type=int,
+        default=1,
+        help="Quantidade de workers nesta máquina (padrão: 1)",
+    )
+
+    sub.add_parser("status", help="Mostra o resumo da fila")
+
+    return parser.parse_args()
+
+
+# ================== MAIN ==================
+
+
+def main():
+    args = parse_args()
+
+    if args.comando == "criar":
+        if args.data:
+            lista_datas = [parse_data(args.data)]
+        else:
+            data_inicio = parse_data(args.inicio_fim[0])
+            data_fim = parse_data(args.inicio_fim[1])
+            if data_fim < data_inicio:
+                raise SystemExit("DATA_FIM não pode ser menor que DATA_INICIO.")
+            lista_datas = gerar_intervalo_datas(data_inicio, data_fim)
+
+        linha = None if args.linha.lower() in ("todas", "all", "") else args.linha
+
+        if args.empresa.lower() in ("todas", "all", ""):
+            session = criar_sessao_com_retry()
+            _, empresas = obter_identificacao_login(session)
+        else:
+            empresas = [args.empresa]
+
+        conn = conectar_fila(args.db)
+        inseridos = enfileirar_itens(conn, lista_datas, empresas, linha)
+        print(f"{inseridos} itens novos na fila ({len(lista_datas)} datas x {len(empresas)} empresas).")
+        print("Status:", resumo_fila(conn))
+        conn.close()
+
+    elif args.comando == "worker":
+        if args.processos <= 1:
+            _rodar_worker_processo(args.db, 0)
+            return
+        processos = [
+            multiprocessing.Process(target=_rodar_worker_processo, args=(args.db, i))
+            for i in range(args.processos)
+        ]
+        for p in processos:
+            p.start()
+        for p in processos:
+            p.join()
+
+    else:
+        conn = conectar_fila(args.db)
+        print("Status:", resumo_fila(conn))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
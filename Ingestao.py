@@ -0,0 +1,503 @@
+# Ingestao.py
+"""
+Carrega os backups (backup_cittati_*.txt soltos e dentro dos lotes .zip)
+num SQLite indexado para consultas SQL.
+
+Tabelas:
+  - viagens    (data, empresa, linha, veiculo, json completo da viagem)
+  - deteccoes  (viagem_id, data, empresa, linha, veiculo, json da detecção)
+  - viagens_arquivos    (de quais arquivos de backup cada viagem veio)
+  - arquivos_carregados (arquivo já carregado + tamanho e modificação)
+
+Só entram arquivos novos (ou que mudaram de tamanho ou de data de
+modificação), então dá para rodar toda noite depois do Diario.py. O mesmo
+arquivo .txt que depois vai para um lote .zip não é carregado de novo.
+
+Cada viagem tem uma chave natural (data, empresa, chave): o hash do JSON
+canônico da viagem mais a ocorrência dele no arquivo (1ª, 2ª...). A mesma
+viagem vinda de vários arquivos (ex: Diario.py + Backup_Cittati.py do
+mesmo dia) entra uma vez só; viagens de um mesmo arquivo nunca se anulam.
+Uma viagem só sai do banco quando nenhum arquivo a contém mais.
+
+Exemplo:
+  python Ingestao.py
+  sqlite3 backups_cittati/cittati.sqlite3 \
+      "SELECT veiculo, COUNT(*) FROM viagens WHERE data = '2025-11-23' GROUP BY veiculo"
+"""
+import os
+import re
+import json
+import hashlib
+import time
+import sqlite3
+import zipfile
+import argparse
+import unicodedata
+
+from Compactador import BACKUP_DIR
+
+
+# ================== CONFIGURAÇÕES ==================
+
+INGESTAO_DB = os.path.join(BACKUP_DIR, "cittati.sqlite3")
+
+PADRAO_TXT = re.compile(r"^backup_cittati_\d{8}.*\.txt$")
+PADRAO_ZIP = re.compile(r"^backups_cittati_lote_\d{8}_\d{8}\.zip$")
+
+# Quantidade de linhas por executemany
+TAMANHO_LOTE_INSERT = 5000
+
+
+# ================== BANCO ==================
+
+
+def conectar_banco(caminho_db):
+    """Abre o SQLite e cria tabelas/índices se não existirem."""
+    pasta = os.path.dirname(caminho_db)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+
+    conn = sqlite3.connect(caminho_db, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS arquivos_carregados (
+            nome          TEXT PRIMARY KEY,
+            tamanho       INTEGER NOT NULL,
+            modificado    TEXT NOT NULL,
+            origem        TEXT NOT NULL,
+            carregado_em  TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS viagens (
+            id       INTEGER PRIMARY KEY,
+            data     TEXT NOT NULL,
+            empresa  TEXT NOT NULL,
+            chave    TEXT NOT NULL,
+            linha    TEXT,
+            veiculo  TEXT,
+            json     TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS viagens_arquivos (
+            viagem_id  INTEGER NOT NULL REFERENCES viagens (id),
+            arquivo    TEXT NOT NULL,
+            PRIMARY KEY (viagem_id, arquivo)
+        );
+
+        CREATE TABLE IF NOT EXISTS deteccoes (
+            id         INTEGER PRIMARY KEY,
+            viagem_id  INTEGER NOT NULL REFERENCES viagens (id),
+            data       TEXT NOT NULL,
+            empresa    TEXT NOT NULL,
+            linha      TEXT,
+            veiculo    TEXT,
+            json       TEXT NOT NULL
+        );
+
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_viagens_chave
+            ON viagens (data, empresa, chave);
+        CREATE INDEX IF NOT EXISTS idx_viagens_data ON viagens (data);
+        CREATE INDEX IF NOT EXISTS idx_viagens_empresa ON viagens (empresa, data);
+        CREATE INDEX IF NOT EXISTS idx_viagens_linha ON viagens (linha, data);
+        CREATE INDEX IF NOT EXISTS idx_viagens_veiculo ON viagens (veiculo, data);
+        CREATE INDEX IF NOT EXISTS idx_viagens_arquivos_arquivo
+            ON viagens_arquivos (arquivo);
+
+        CREATE INDEX IF NOT EXISTS idx_deteccoes_viagem ON deteccoes (viagem_id);
+        CREATE INDEX IF NOT EXISTS idx_deteccoes_data ON deteccoes (data);
+        CREATE INDEX IF NOT EXISTS idx_deteccoes_empresa ON deteccoes (empresa, data);
+        CREATE INDEX IF NOT EXISTS idx_deteccoes_linha ON deteccoes (linha, data);
+        CREATE INDEX IF NOT EXISTS idx_deteccoes_veiculo ON deteccoes (veiculo, data);
+        """
+    )
+    return conn
+
+
+def arquivos_ja_carregados(conn):
+    """Retorna {nome: (tamanho, modificado)} dos arquivos já carregados."""
+    return {
+        nome: (tamanho, modificado)
+        for nome, tamanho, modificado in conn.execute(
+            "SELECT nome, tamanho, modificado FROM arquivos_carregados"
+        )
+    }
+
+
+# ================== NORMALIZAÇÃO DO PAYLOAD ==================
+
+
+def _normalizar_chave(chave):
+    """'Detecções' → 'deteccoes' (minúsculo e sem acento)."""
+    sem_acento = unicodedata.normalize("NFKD", str(chave))
+    return "".join(c for c in sem_acento if not unicodedata.combining(c)).lower()
+
+
+def _valor_escalar(valor):
+    if isinstance(valor, (str, int, float)) and not isinstance(valor, bool):
+        return str(valor)
+    return None
+
+
+def _buscar_campo(obj, exatos, contendo):
+    """
+    Procura no dict um campo escalar: primeiro pelos nomes exatos (na ordem),
+    depois qualquer chave que contenha um dos trechos de 'contendo'.
+    """
+    chaves = {_normalizar_chave(k): v for k, v in obj.items()}
+    for nome in exatos:
+        valor = _valor_escalar(chaves.get(nome))
+        if valor is not None:
+            return valor
+    for chave, valor in chaves.items():
+        if any(trecho in chave for trecho in contendo):
+            valor = _valor_escalar(valor)
+            if valor is not None:
+                return valor
+    return None
+
+
+def _lista_de_dicts(valor):
+    return isinstance(valor, list) and any(isinstance(v, dict) for v in valor)
+
+
+def extrair_viagens(dados):
+    """
+    Devolve a lista de viagens (dicts) da resposta de uma empresa.
+    Aceita lista direta ou dict com a lista dentro (chave com 'viage' no nome
+    ou, na falta, a primeira lista de objetos). Erros/raw → lista vazia.
+    """
+    if isinstance(dados, list):
+        return [v for v in dados if isinstance(v, dict)]
+    if not isinstance(dados, dict):
+        return []
+
+    for chave, valor in dados.items():
+        if "viage" in _normalizar_chave(chave) and _lista_de_dicts(valor):
+            return [v for v in valor if isinstance(v, dict)]
+    for valor in dados.values():
+        if _lista_de_dicts(valor):
+            return [v for v in valor if isinstance(v, dict)]
+    return []
+
+
+def extrair_deteccoes(viagem):
+    """Lista de detecções (dicts) dentro de uma viagem, se houver."""
+    for chave, valor in viagem.items():
+        if "detec" in _normalizar_chave(chave) and isinstance(valor, list):
+            return [d for d in valor if isinstance(d, dict)]
+    return []
+
+
+def hash_viagem(viagem):
+    """sha1 do JSON canônico da viagem (chaves ordenadas)."""
+    canonico = json.dumps(viagem, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(canonico.encode("utf-8")).hexdigest()
+
+
+def chaves_viagens(viagens):
+    """
+    Chave natural de cada viagem de uma empresa num arquivo: hash do JSON
+    + ocorrência ("<sha1>:1", "<sha1>:2"...). Números de viagem se repetem
+    entre linhas/veículos, por isso o JSON inteiro entra na chave; e duas
+    viagens idênticas no mesmo arquivo continuam sendo duas.
+    """
+    ocorrencias = {}
+    chaves = []
+    for viagem in viagens:
+        h = hash_viagem(viagem)
+        ocorrencias[h] = ocorrencias.get(h, 0) + 1
+        chaves.append(f"{h}:{ocorrencias[h]}")
+    return chaves
+
+
+def extrair_linha(obj):
+    return _buscar_campo(
+        obj, ("linha", "codigolinha", "numerolinha", "idlinha"), ("linha",)
+    )
+
+
+def extrair_veiculo(obj):
+    return _buscar_campo(
+        obj,
+        ("veiculo", "prefixo", "prefixoveiculo", "codigoveiculo", "numeroveiculo"),
+        ("veiculo", "prefixo"),
+    )
+
+
+# ================== CARGA ==================
+
+
+def _inserir_em_lotes(conn, sql, linhas):
+    for i in range(0, len(linhas), TAMANHO_LOTE_INSERT):
+        conn.executemany(sql, linhas[i : i + TAMANHO_LOTE_INSERT])
+
+
+def _remover_viagens_orfas(conn, candidatas):
+    """
+    Apaga (com as detecções) as viagens de 'candidatas' que não estão em
+    mais nenhum arquivo. Retorna quantas foram apagadas.
+    """
+    orfas = []
+    # IN (...) em pedaços: o SQLite limita a quantidade de parâmetros
+    for i in range(0, len(candidatas), 500):
+        pedaco = candidatas[i : i + 500]
+        marcas = ", ".join("?" * len(pedaco))
+        ligadas = {
+            row[0]
+            for row in conn.execute(
+                f"SELECT DISTINCT viagem_id FROM viagens_arquivos "
+                f"WHERE viagem_id IN ({marcas})",
+                pedaco,
+            )
+        }
+        orfas.extend((v,) for v in pedaco if v not in ligadas)
+    _inserir_em_lotes(conn, "DELETE FROM deteccoes WHERE viagem_id = ?", orfas)
+    _inserir_em_lotes(conn, "DELETE FROM viagens WHERE id = ?", orfas)
+    return len(orfas)
+
+
+def carregar_backup(conn, nome, origem, tamanho, modificado, conteudo):
+    """
+    Carrega um arquivo de backup numa única transação:
+      - viagens novas (chave (data, empresa, chave), ver chaves_viagens)
+        entram com as detecções;
+      - viagens que já estavam no banco só ganham este arquivo como fonte
+        (viagens_arquivos);
+      - viagens que eram só deste arquivo e sumiram dele são apagadas.
+    Retorna (qtd_viagens, qtd_deteccoes, qtd_ja_no_banco, qtd_removidas).
+    """
+    backup = json.loads(conteudo)
+    if not isinstance(backup, dict):
+        raise ValueError("conteúdo não é um backup (esperado objeto JSON)")
+    data = backup.get("data", "")
+    linha_arquivo = backup.get("linha")
+    if linha_arquivo in (None, "todas"):
+        linha_arquivo = None
+
+    # ids são gerados aqui para ligar detecção → viagem sem SELECT por linha
+    viagens = []
+    deteccoes = []
+    ligacoes = []
+    ja_no_banco = 0
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # fontes antigas deste arquivo; o que continuar nele é religado abaixo
+        anteriores = [
+            row[0]
+            for row in conn.execute(
+                "SELECT viagem_id FROM viagens_arquivos WHERE arquivo = ?", (nome,)
+            )
+        ]
+        conn.execute("DELETE FROM viagens_arquivos WHERE arquivo = ?", (nome,))
+
+        proximo_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM viagens").fetchone()[0]
+
+        for empresa, dados in (backup.get("empresas") or {}).items():
+            existentes = dict(
+                conn.execute(
+                    "SELECT chave, id FROM viagens WHERE data = ? AND empresa = ?",
+                    (data, empresa),
+                )
+            )
+            lista = extrair_viagens(dados)
+            for viagem, chave in zip(lista, chaves_viagens(lista)):
+                if chave in existentes:
+                    ja_no_banco += 1
+                    ligacoes.append((existentes[chave], nome))
+                    continue
+                proximo_id += 1
+                ligacoes.append((proximo_id, nome))
+                linha = extrair_linha(viagem) or linha_arquivo
+                veiculo = extrair_veiculo(viagem)
+                viagens.append(
+                    (
+                        proximo_id,
+                        data,
+                        empresa,
+                        chave,
+                        linha,
+                        veiculo,
+                        json.dumps(viagem, ensure_ascii=False),
+                    )
+                )
+                for det in extrair_deteccoes(viagem):
+                    deteccoes.append(
+                        (
+                            proximo_id,
+                            data,
+                            empresa,
+                            extrair_linha(det) or linha,
+                            extrair_veiculo(det) or veiculo,
+                            json.dumps(det, ensure_ascii=False),
+                        )
+                    )
+
+        _inserir_em_lotes(
+            conn,
+            "INSERT INTO viagens "
+            "(id, data, empresa, chave, linha, veiculo, json) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            viagens,
+        )
+        _inserir_em_lotes(
+            conn,
+            "INSERT INTO deteccoes "
+            "(viagem_id, data, empresa, linha, veiculo, json) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            deteccoes,
+        )
+        _inserir_em_lotes(
+            conn,
+            "INSERT OR IGNORE INTO viagens_arquivos (viagem_id, arquivo) "
+            "VALUES (?, ?)",
+            ligacoes,
+        )
+        removidas = _remover_viagens_orfas(conn, anteriores)
+        conn.execute(
+            "INSERT OR REPLACE INTO arquivos_carregados "
+            "(nome, tamanho, modificado, origem, carregado_em) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (nome, tamanho, modificado, origem, time.strftime("%Y-%m-%d %H:%M:%S")),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    return len(viagens), len(deteccoes), ja_no_banco, removidas
+
+
+def _ler_arquivo(caminho):
+    with open(caminho, "rb") as f:
+        return f.read()
+
+
+def _ler_do_zip(caminho_zip, membro):
+    with zipfile.ZipFile(caminho_zip) as zf:
+        return zf.read(membro)
+
+
+def _modificado_em(timestamp):
+    """
+    mtime como texto, com a precisão do zip (2 s, horário local): o .txt
+    solto e o mesmo .txt dentro do lote dão o mesmo valor.
+    """
+    t = time.localtime(timestamp)
+    return time.strftime("%Y-%m-%d %H:%M:", t) + f"{t.tm_sec // 2 * 2:02d}"
+
+
+def listar_fontes(pasta):
+    """
+    Gera (nome, origem, tamanho, modificado, leitor) para cada backup
+    encontrado: .txt soltos e .txt dentro dos lotes .zip.
+    'leitor()' devolve os bytes.
+    """
+    if not os.path.exists(pasta):
+        print(f"Pasta '{pasta}' não existe.")
+        return
+
+    for nome in sorted(os.listdir(pasta)):
+        caminho = os.path.join(pasta, nome)
+        if not os.path.isfile(caminho):
+            continue
+
+        if PADRAO_TXT.match(nome):
+            info = os.stat(caminho)
+            yield nome, nome, info.st_size, _modificado_em(info.st_mtime), (
+                lambda c=caminho: _ler_arquivo(c)
+            )
+        elif PADRAO_ZIP.match(nome):
+            # zip corrompido/incompleto não pode derrubar a ingestão inteira
+            try:
+                with zipfile.ZipFile(caminho) as zf:
+                    membros = [
+                        i for i in zf.infolist() if PADRAO_TXT.match(i.filename)
+                    ]
+            except (OSError, zipfile.BadZipFile) as e:
+                print(f"  -> Erro ao abrir {nome}: {e} (ignorado)")
+                continue
+            for info in membros:
+                modificado = "%04d-%02d-%02d %02d:%02d:%02d" % info.date_time
+                yield info.filename, nome, info.file_size, modificado, (
+                    lambda c=caminho, m=info.filename: _ler_do_zip(c, m)
+                )
+
+
+def ingerir(caminho_db, pasta=BACKUP_DIR):
+    """Carrega no banco os backups novos/alterados de 'pasta'."""
+    conn = conectar_banco(caminho_db)
+    carregados = arquivos_ja_carregados(conn)
+
+    novos = 0
+    total_viagens = 0
+    total_deteccoes = 0
+
+    try:
+        for nome, origem, tamanho, modificado, leitor in listar_fontes(pasta):
+            if carregados.get(nome) == (tamanho, modificado):
+                continue
+
+            try:
+                qtd_v, qtd_d, qtd_ja, qtd_rem = carregar_backup(
+                    conn, nome, origem, tamanho, modificado, leitor()
+                )
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                print(f"  -> Erro ao carregar {nome} ({origem}): {e}")
+                continue
+
+            carregados[nome] = (tamanho, modificado)
+            novos += 1
+            total_viagens += qtd_v
+            total_deteccoes += qtd_d
+            extras = []
+            if qtd_ja:
+                extras.append(f"{qtd_ja} já estavam no banco")
+            if qtd_rem:
+                extras.append(f"{qtd_rem} removidas")
+            extras = f" ({', '.join(extras)})" if extras else ""
+            print(f"  -> {nome}: {qtd_v} viagens novas, {qtd_d} detecções{extras}")
+    finally:
+        conn.close()
+
+    if novos == 0:
+        print("Nenhum arquivo novo para carregar.")
+    else:
+        print(
+            f"Ingestão concluída: {novos} arquivos, "
+            f"{total_viagens} viagens, {total_deteccoes} detecções."
+        )
+
+
+# ================== PARSE DE ARGUMENTOS ==================
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Carrega os backups Cittati num SQLite indexado."
+    )
+    parser.add_argument(
+        "--db",
+        default=INGESTAO_DB,
+        help=f"Arquivo SQLite de destino (padrão: {INGESTAO_DB})",
+    )
+    parser.add_argument(
+        "--pasta",
+        default=BACKUP_DIR,
+        help=f"Pasta com os backups (padrão: {BACKUP_DIR})",
+    )
+    return parser.parse_args()
+
+
+# ================== MAIN ==================
+
+
+def main():
+    args = parse_args()
+    ingerir(args.db, args.pasta)
+
+
+if __name__ == "__main__":
+    main()
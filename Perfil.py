@@ -0,0 +1,276 @@
+# Perfil.py
+"""
+Modo --profile dos scripts (Diario.py, Backup_Cittati.py, Compactador.py).
+
+Cada etapa (login, rede, resp.json, json.dump, zip...) é medida com
+tempo de parede, tempo de CPU e pico de memória (tracemalloc), no total e
+por empresa. No fim sai uma tabela ordenada pelas etapas mais caras.
+Opcionalmente grava um dump do cProfile (abrir com snakeviz/pstats).
+
+Uso nos scripts:
+
+    from Perfil import perfil
+
+    with perfil.etapa("rede", empresa=empresa):
+        resp = session.get(...)
+
+Com o perfil desligado (padrão) as etapas não fazem nada.
+
+Etapas podem rodar em várias threads (Diario.py com várias contas). Nesse
+modo o pico de memória por etapa não é medido, porque o tracemalloc só
+mede o processo inteiro. O relatório mostra "-" nessas etapas e dá só o
+pico do processo. O cProfile da thread principal não vê as outras
+threads, então cada etapa de fora da thread principal ganha um cProfile
+próprio, somado ao dump no fim.
+"""
+import time
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+# Quantas empresas mostrar no ranking por empresa
+TOP_EMPRESAS = 10
+
+# Quantas funções mostrar do cProfile
+TOP_FUNCOES = 15
+
+
+def extrair_opcoes_perfil(argv):
+    """
+    Tira --profile e --profile-saida ARQ da lista de argumentos (para os
+    scripts que não usam argparse). Retorna (ativo, arquivo_cprofile, resto).
+    """
+    ativo = False
+    arquivo = None
+    resto = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "--profile":
+            ativo = True
+        elif arg == "--profile-saida":
+            if i + 1 >= len(argv):
+                raise SystemExit("--profile-saida precisa do caminho do arquivo.")
+            ativo = True
+            arquivo = argv[i + 1]
+            i += 1
+        elif arg.startswith("--profile-saida="):
+            ativo = True
+            arquivo = arg.split("=", 1)[1]
+        else:
+            resto.append(arg)
+        i += 1
+    return ativo, arquivo, resto
+
+
+def _mb(n_bytes):
+    return n_bytes / (1024 * 1024)
+
+
+def _fmt_pico(pico, largura):
+    """Pico em MB alinhado; '-' quando não foi medido (modo threads)."""
+    if pico is None:
+        return f"{'-':>{largura}}"
+    return f"{_mb(pico):>{largura}.1f}"
+
+
+class Perfilador:
+    """Acumula tempo/CPU/memória por etapa e por (etapa, empresa)."""
+
+    def __init__(self):
+        self.ativo = False
+        self.arquivo_cprofile = None
+        self._cprofile = None
+        self._inicio = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.por_etapa = {}
+        self.por_empresa = {}
+        self.em_threads = False
+        self._pico_processo = 0
+        self._cprofiles_threads = []
+        self._cprofile_so_principal = False
+
+    def iniciar(self, arquivo_cprofile=None):
+        """Liga a medição (tracemalloc e, se pedido, cProfile)."""
+        self.ativo = True
+        self.arquivo_cprofile = arquivo_cprofile
+        self._inicio = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if arquivo_cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def modo_threads(self):
+        """
+        Avisa que as próximas etapas rodam em paralelo: para de zerar o
+        pico do tracemalloc e não mede mais pico por etapa.
+        """
+        self.em_threads = True
+
+    def _acumular(self, destino, chave, parede, cpu, pico):
+        """pico=None → etapa rodou com outras threads (pico não medido)."""
+        with self._lock:
+            reg = destino.setdefault(
+                chave, {"chamadas": 0, "parede": 0.0, "cpu": 0.0, "pico": 0}
+            )
+            reg["chamadas"] += 1
+            reg["parede"] += parede
+            reg["cpu"] += cpu
+            if pico is None or reg["pico"] is None:
+                reg["pico"] = None
+            else:
+                reg["pico"] = max(reg["pico"], pico)
+
+    def _cprofile_da_thread(self):
+        """
+        cProfile próprio para uma etapa fora da thread principal (o da
+        thread principal não vê as outras). None se não der para ligar.
+        """
+        if self._cprofile is None:
+            return None
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # Python 3.12+: só um profiler por vez no processo
+            self._cprofile_so_principal = True
+            return None
+        return prof
+
+    def _pilha(self):
+        """Etapas abertas na thread atual."""
+        if not hasattr(self._local, "pilha"):
+            self._local.pilha = []
+        return self._local.pilha
+
+    @contextmanager
+    def etapa(self, nome, empresa=None):
+        """Mede o bloco como a etapa 'nome' (e também por empresa, se dada)."""
+        if not self.ativo:
+            yield
+            return
+
+        pilha = self._pilha()
+        fora_da_principal = threading.current_thread() is not threading.main_thread()
+        if fora_da_principal:
+            self.em_threads = True
+
+        # o pico do tracemalloc é global: antes de zerar, repassa o pico
+        # atual para a etapa de fora (etapas podem ser aninhadas). Com
+        # várias threads não zera, senão uma thread apaga o pico da outra.
+        atual, pico = tracemalloc.get_traced_memory()
+        self._pico_processo = max(self._pico_processo, pico)
+        if pilha:
+            pilha[-1]["pico"] = max(pilha[-1]["pico"], pico)
+        if not self.em_threads and hasattr(tracemalloc, "reset_peak"):  # 3.9+
+            tracemalloc.reset_peak()
+
+        prof = self._cprofile_da_thread() if fora_da_principal and not pilha else None
+        reg = {"base": atual, "pico": 0}
+        pilha.append(reg)
+        t0 = time.perf_counter()
+        c0 = time.thread_time()
+        try:
+            yield
+        finally:
+            parede = time.perf_counter() - t0
+            cpu = time.thread_time() - c0
+            if prof is not None:
+                prof.disable()
+                with self._lock:
+                    self._cprofiles_threads.append(prof)
+            pico = max(reg["pico"], tracemalloc.get_traced_memory()[1])
+            self._pico_processo = max(self._pico_processo, pico)
+            pilha.pop()
+            if pilha:
+                pilha[-1]["pico"] = max(pilha[-1]["pico"], pico)
+
+            pico_etapa = None if self.em_threads else max(0, pico - reg["base"])
+            self._acumular(self.por_etapa, nome, parede, cpu, pico_etapa)
+            if empresa is not None:
+                self._acumular(
+                    self.por_empresa, (nome, empresa), parede, cpu, pico_etapa
+                )
+
+    def finalizar(self):
+        """Desliga a medição, grava o cProfile e imprime o relatório."""
+        if not self.ativo:
+            return
+        total = time.perf_counter() - self._inicio
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            stats = pstats.Stats(self._cprofile)
+            for prof in self._cprofiles_threads:
+                stats.add(prof)
+            stats.dump_stats(self.arquivo_cprofile)
+
+        self._pico_processo = max(self._pico_processo, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        self.ativo = False
+        self._imprimir_relatorio(total)
+
+    def _imprimir_relatorio(self, total):
+        print("\n================ PERFIL ================")
+        print(f"Tempo total: {total:.2f}s")
+        if self.em_threads:
+            print(
+                "Etapas rodaram em várias threads: o pico por etapa não é medido "
+                "(tracemalloc mede o processo inteiro) e o tempo de parede "
+                "soma as threads."
+            )
+            print(f"Pico de memória do processo: {_mb(self._pico_processo):.1f} MB")
+        print()
+
+        print(
+            f"{'#':>2}  {'etapa':<22} {'chamadas':>8} {'parede (s)':>11} "
+            f"{'% total':>8} {'CPU (s)':>9} {'pico (MB)':>10}"
+        )
+        ranking = sorted(
+            self.por_etapa.items(), key=lambda kv: kv[1]["parede"], reverse=True
+        )
+        for pos, (nome, reg) in enumerate(ranking, start=1):
+            pct = 100 * reg["parede"] / total if total > 0 else 0
+            print(
+                f"{pos:>2}  {nome:<22} {reg['chamadas']:>8} {reg['parede']:>11.2f} "
+                f"{pct:>7.1f}% {reg['cpu']:>9.2f} {_fmt_pico(reg['pico'], 10)}"
+            )
+
+        if self.por_empresa:
+            print(f"\nTop {TOP_EMPRESAS} (etapa, empresa) por tempo:")
+            ranking = sorted(
+                self.por_empresa.items(),
+                key=lambda kv: kv[1]["parede"],
+                reverse=True,
+            )[:TOP_EMPRESAS]
+            for pos, ((nome, empresa), reg) in enumerate(ranking, start=1):
+                print(
+                    f"{pos:>2}  {nome:<12} {empresa:<40} {reg['parede']:>9.2f}s "
+                    f"CPU {reg['cpu']:>7.2f}s  pico {_fmt_pico(reg['pico'], 7)} MB"
+                )
+
+        if self.arquivo_cprofile:
+            print(f"\ncProfile gravado em: {self.arquivo_cprofile}")
+            if self._cprofiles_threads:
+                print(
+                    f"(inclui {len(self._cprofiles_threads)} etapas de outras threads)"
+                )
+            if self._cprofile_so_principal:
+                print(
+                    "Atenção: este Python não permite um cProfile por thread; "
+                    "o dump cobre só a thread principal."
+                )
+            print(f"Top {TOP_FUNCOES} funções (tempo acumulado):")
+            pstats.Stats(self.arquivo_cprofile).sort_stats("cumulative").print_stats(
+                TOP_FUNCOES
+            )
+        print("========================================\n")
+
+
+# Instância única usada pelos scripts
+perfil = Perfilador()
@@ -0,0 +1,303 @@
+# Requisicoes.py
+"""
+Funções HTTP usadas pelo Diario.py e pelo Backup_Cittati.py (e, através
+deles, pelo Fila.py e pelo Agendador.py):
+
+- sessão requests com retry automático
+- timeout adaptativo por empresa (histórico de latência/tamanho)
+- hedge: requisição duplicada quando a empresa passa do p90 de latência
+- laço de retentativas por empresa
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from Compactador import BACKUP_DIR
+
+
+# ================== CONFIGURAÇÕES ==================
+
+# Timeout adaptativo por empresa (histórico de latência/tamanho por empresa)
+HISTORICO_LATENCIAS_ARQ = os.path.join(BACKUP_DIR, "historico_latencias.json")
+HISTORICO_MAX_AMOSTRAS = 30   # guarda só as últimas N medições de cada empresa
+HISTORICO_MIN_AMOSTRAS = 5    # abaixo disso usa o timeout fixo do script
+FATOR_TIMEOUT = 3             # timeout = p95 da latência x fator
+TIMEOUT_MIN = 30
+TIMEOUT_MAX = 600
+PERCENTIL_HEDGE = 0.90        # passou do p90 → dispara requisição duplicada
+
+# Processos longos (Fila.py, Agendador.py) refazem o login depois disso
+RENOVAR_LOGIN_A_CADA = 20 * 60
+
+
+# ================== SESSÃO ==================
+
+
+def criar_sessao_com_retry():
+    """Cria sessão requests com retry automático."""
+    session = requests.Session()
+    retry_strategy = Retry(
+        total=5,
+        backoff_factor=2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["HEAD", "GET", "OPTIONS", "POST"],
+    )
+    adapter = HTTPAdapter(max_retries=retry_strategy)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def resposta_token_invalido(dados):
+    """True se a API respondeu 'Token inválido' (codigoErro 02)."""
+    return isinstance(dados, dict) and dados.get("codigoErro") == "02"
+
+
+# ================== TIMEOUT ADAPTATIVO / HEDGE ==================
+
+
+def carregar_historico_latencias():
+    """
+    Lê o histórico de latências por empresa (e linha, ver chave_historico):
+      {chave: [{"segundos": float, "bytes": int, "em": timestamp}, ...]}
+    Amostras de timeout têm também "estourou": True (ver registrar_latencia).
+    Se o arquivo não existir ou estiver corrompido, começa vazio.
+    """
+    if not os.path.exists(HISTORICO_LATENCIAS_ARQ):
+        return {}
+    try:
+        with open(HISTORICO_LATENCIAS_ARQ, "r", encoding="utf-8") as f:
+            historico = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Atenção: não foi possível ler {HISTORICO_LATENCIAS_ARQ}: {e}")
+        return {}
+    return historico if isinstance(historico, dict) else {}
+
+
+def _juntar_amostras(*listas):
+    """Une listas de amostras sem repetir, da mais antiga para a mais nova."""
+    vistas = {}
+    for amostras in listas:
+        for a in amostras:
+            vistas[json.dumps(a, sort_keys=True)] = a
+    juntas = sorted(vistas.values(), key=lambda a: a.get("em", 0))
+    return juntas[-HISTORICO_MAX_AMOSTRAS:]
+
+
+def salvar_historico_latencias(historico):
+    """
+    Grava o histórico (arquivo temporário + rename, para não corromper).
+    Antes junta com o que está no disco: vários workers (Fila.py) salvam o
+    mesmo arquivo e um não pode apagar as medições do outro.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    no_disco = carregar_historico_latencias()
+    for empresa, amostras in historico.items():
+        historico[empresa] = _juntar_amostras(no_disco.pop(empresa, []), amostras)
+    for empresa, amostras in no_disco.items():
+        historico[empresa] = _juntar_amostras(amostras)
+
+    tmp = f"{HISTORICO_LATENCIAS_ARQ}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(historico, f, ensure_ascii=False)
+    os.replace(tmp, HISTORICO_LATENCIAS_ARQ)
+
+
+def chave_historico(empresa, linha=None):
+    """
+    Chave do histórico: o dia inteiro da empresa e uma linha só têm
+    latência/tamanho bem diferentes, então cada linha tem a sua janela.
+    Sem linha a chave é a própria empresa.
+    """
+    return empresa if not linha else f"{empresa}|linha={linha}"
+
+
+def registrar_latencia(historico, empresa, segundos, tamanho_bytes, estourou=False):
+    """
+    Adiciona uma medição e descarta as mais antigas.
+    estourou=True → a chamada deu timeout; segundos é o timeout usado (a
+    latência real foi maior), o que puxa o p95 da empresa para cima.
+    """
+    amostras = historico.setdefault(empresa, [])
+    amostra = {
+        "segundos": round(segundos, 3),
+        "bytes": int(tamanho_bytes),
+        "em": round(time.time(), 3),
+    }
+    if estourou:
+        amostra["estourou"] = True
+    amostras.append(amostra)
+    del amostras[:-HISTORICO_MAX_AMOSTRAS]
+
+
+def percentil(valores, p):
+    """Percentil simples (nearest-rank) de uma lista não vazia, p em [0, 1]."""
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, max(0, int(round(p * len(ordenados))) - 1))
+    return ordenados[idx]
+
+
+def calcular_timeout_empresa(historico, empresa, timeout_padrao):
+    """
+    Timeout da empresa a partir do histórico:
+      - p95 da latência observada
+      - tempo estimado para baixar o maior payload recente na vazão mediana
+    O maior dos dois vezes FATOR_TIMEOUT, limitado a [TIMEOUT_MIN, TIMEOUT_MAX].
+    Sem histórico suficiente → timeout_padrao.
+    Timeouts entram na latência (como o tempo esperado), mas não na vazão.
+    """
+    amostras = historico.get(empresa) or []
+    if len(amostras) < HISTORICO_MIN_AMOSTRAS:
+        return timeout_padrao
+
+    latencias = [a["segundos"] for a in amostras]
+    base = percentil(latencias, 0.95)
+
+    completas = [a for a in amostras if not a.get("estourou")]
+    vazoes = [a["bytes"] / a["segundos"] for a in completas if a["segundos"] > 0]
+    if vazoes:
+        vazao_mediana = percentil(vazoes, 0.5)
+        maior_payload = max(a["bytes"] for a in completas)
+        if vazao_mediana > 0:
+            base = max(base, maior_payload / vazao_mediana)
+
+    return min(TIMEOUT_MAX, max(TIMEOUT_MIN, base * FATOR_TIMEOUT))
+
+
+def limiar_hedge_empresa(historico, empresa):
+    """
+    Tempo após o qual vale mandar uma requisição duplicada (p90 da latência).
+    None → sem histórico suficiente, não faz hedge.
+    """
+    amostras = historico.get(empresa) or []
+    if len(amostras) < HISTORICO_MIN_AMOSTRAS:
+        return None
+    return percentil([a["segundos"] for a in amostras], PERCENTIL_HEDGE)
+
+
+def get_com_hedge(session, url, params, headers, timeout, limiar_hedge):
+    """
+    Faz o GET; se não responder em limiar_hedge segundos, dispara um GET
+    duplicado numa sessão nova e devolve a primeira resposta que chegar.
+    Se as duas falharem, levanta a exceção da última.
+    A requisição perdedora não é cancelada (requests não permite), mas
+    termina sozinha dentro do próprio timeout.
+    """
+    if limiar_hedge is None or limiar_hedge >= timeout:
+        return session.get(url, params=params, headers=headers, timeout=timeout)
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    try:
+        original = pool.submit(
+            session.get, url, params=params, headers=headers, timeout=timeout
+        )
+        feitos, _ = wait([original], timeout=limiar_hedge)
+        if feitos:
+            return original.result()
+
+        print(f"     (sem resposta em {limiar_hedge:.1f}s, enviando requisição duplicada)")
+        sessao_hedge = criar_sessao_com_retry()
+        duplicada = pool.submit(
+            sessao_hedge.get, url, params=params, headers=headers, timeout=timeout
+        )
+
+        pendentes = {original, duplicada}
+        erro = None
+        while pendentes:
+            feitos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+            for fut in feitos:
+                if fut.exception() is None:
+                    if fut is duplicada:
+                        print("     (requisição duplicada respondeu primeiro)")
+                    return fut.result()
+                erro = fut.exception()
+        raise erro
+    finally:
+        pool.shutdown(wait=False)
+
+
+def timeout_da_tentativa(historico, empresa, timeout_padrao, tentativa=1):
+    """
+    Timeout adaptativo da empresa, dobrado a cada nova tentativa
+    (tentativa 2 → x2, 3 → x4...), até TIMEOUT_MAX.
+    """
+    timeout = calcular_timeout_empresa(historico, empresa, timeout_padrao)
+    if tentativa > 1:
+        timeout = max(timeout, min(TIMEOUT_MAX, timeout * 2 ** (tentativa - 1)))
+    return timeout
+
+
+def get_adaptativo(
+    session,
+    url,
+    params,
+    headers,
+    historico,
+    empresa,
+    timeout_padrao,
+    tentativa=1,
+    linha=None,
+    hedge=True,
+):
+    """
+    GET com timeout/hedge calculados pelo histórico da empresa (ou da
+    empresa + linha, quando a consulta é de uma linha só).
+    A medição da chamada é registrada no histórico, inclusive quando dá
+    timeout (amostra penalizada), para o timeout da empresa poder crescer.
+    hedge=False → nunca manda requisição duplicada (ex: conta com limite
+    de requisições simultâneas, em que a duplicada furaria o limite).
+    """
+    empresa = chave_historico(empresa, linha)
+    timeout = timeout_da_tentativa(historico, empresa, timeout_padrao, tentativa)
+    inicio = time.perf_counter()
+    try:
+        resp = get_com_hedge(
+            session,
+            url,
+            params,
+            headers,
+            timeout,
+            limiar_hedge_empresa(historico, empresa) if hedge else None,
+        )
+    except requests.Timeout:
+        registrar_latencia(historico, empresa, timeout, 0, estourou=True)
+        raise
+    if resp.ok:
+        registrar_latencia(
+            historico, empresa, time.perf_counter() - inicio, len(resp.content)
+        )
+    return resp
+
+
+# ================== RETENTATIVAS ==================
+
+
+def buscar_com_retentativas(buscar, empresa, max_tentativas):
+    """
+    Chama buscar(tentativa) até max_tentativas vezes, esperando 5s x
+    tentativa entre as falhas de rede. Retorna o que vai no backup para a
+    empresa: os dados, [] (sem conteúdo) ou {"erro": "falha_apos_retentativas"}.
+    """
+    for tentativa in range(1, max_tentativas + 1):
+        try:
+            dados = buscar(tentativa)
+            return dados if dados is not None else []
+        except (
+            requests.Timeout,
+            requests.ConnectionError,
+            requests.RequestException,
+        ) as e:
+            print(
+                f"     Erro (tentativa {tentativa}/{max_tentativas}) "
+                f"para empresa {empresa}: {e}"
+            )
+            time.sleep(5 * tentativa)
+
+    print(f"     Falha definitiva para empresa {empresa}")
+    return {"erro": "falha_apos_retentativas"}